@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints from which solver runs can be resumed.
+"""
+
+import json
+import os
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+
+from packed_schedule import pack_bits, unpack_bits
+
+
+class Checkpoint(BaseModel):
+    """
+    This class represents the state of a solver run, from which the run can
+    be resumed: the working and the best schedule, the state of the random
+    number generator, the counters and scalars of the solver (e.g. its
+    temperature) and its arrays (e.g. its tabu list).
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    method: str
+    duties: np.ndarray
+    score: float
+    best_duties: np.ndarray
+    best_score: float
+    rng_state: dict
+    counters: dict[str, int | float]
+    arrays: dict[str, np.ndarray] = {}
+    elapsed: float
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint):
+    """
+    Saves a checkpoint to a compressed binary file, with the schedules packed
+    into bits. The file is replaced at once, so a crash while saving leaves
+    the previous checkpoint intact.
+
+    Args:
+        path (str): The file path.
+        checkpoint (Checkpoint): The checkpoint.
+    """
+    meta = {
+        "method": checkpoint.method,
+        "shape": list(checkpoint.duties.shape),
+        "score": checkpoint.score,
+        "best_score": checkpoint.best_score,
+        "rng_state": checkpoint.rng_state,
+        "counters": checkpoint.counters,
+        "elapsed": checkpoint.elapsed,
+    }
+    arrays = {f"array_{name}": array for name, array in checkpoint.arrays.items()}
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        np.savez_compressed(file, meta=np.array(json.dumps(meta)),
+                            duties=pack_bits(checkpoint.duties),
+                            best_duties=pack_bits(checkpoint.best_duties), **arrays)
+    os.replace(temporary_path, path)
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """
+    Loads a checkpoint saved by save_checkpoint.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        Checkpoint: The checkpoint.
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        n_services = meta["shape"][1]
+        arrays = {name[len("array_"):]: data[name] for name in data.files
+                  if name.startswith("array_")}
+
+        return Checkpoint(method=meta["method"],
+                          duties=unpack_bits(data["duties"], n_services),
+                          score=meta["score"],
+                          best_duties=unpack_bits(data["best_duties"], n_services),
+                          best_score=meta["best_score"],
+                          rng_state=meta["rng_state"],
+                          counters=meta["counters"],
+                          arrays=arrays,
+                          elapsed=meta["elapsed"])
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    duties_ = rng.integers(2, size=(13, 38))
+    checkpoint_ = Checkpoint(method="example", duties=duties_, score=1.0,
+                             best_duties=duties_, best_score=1.0,
+                             rng_state=rng.bit_generator.state,
+                             counters={"n_evaluations": 1000}, elapsed=0.5)
+
+    save_checkpoint("example_checkpoint.npz", checkpoint_)
+    loaded = load_checkpoint("example_checkpoint.npz")
+    print(np.array_equal(loaded.duties, duties_), loaded.counters)
+    os.remove("example_checkpoint.npz")
@@ -19,6 +19,43 @@ def services_to_list(services) -> list:
     """
     return list(itertools.chain.from_iterable(services.values()))
 
+def get_date_groups(services) -> list[list[int]]:
+    """
+    Groups the column indices of the services by date.
+
+    Args:
+        services (Services): dictionary containing the services per date.
+
+    Returns:
+        list[list[int]]: The column indices of the services of every date,
+            in the order of the dictionary.
+    """
+    bounds = list(itertools.accumulate([len(services_of_date)
+                                        for services_of_date in services.values()],
+                                       initial=0))
+    return [list(range(start, end)) for start, end in zip(bounds, bounds[1:])]
+
+def get_week_groups(services) -> list[list[int]]:
+    """
+    Groups the column indices of the services by calendar week, so a
+    special day is grouped with the Sunday of the same week.
+
+    Args:
+        services (Services): dictionary containing the services per date.
+
+    Returns:
+        list[list[int]]: The column indices of the services of every week,
+            in chronological order.
+    """
+    weeks = {}
+    column = 0
+    for date, services_of_date in services.items():
+        week = weeks.setdefault(tuple(date.isocalendar())[:2], [])
+        week.extend(range(column, column + len(services_of_date)))
+        column += len(services_of_date)
+
+    return list(weeks.values())
+
 def date_biddag(year: int) -> datetime:
     """
     Returns the date of biddag (first Wednesday of November) for a given year.
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Exact branch-and-bound solver with an optimality gap.
+"""
+
+import heapq
+import time
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+
+from create_xlsx import kerkenraad, services_dict
+from date_utils import services_to_list
+from rules import Rules
+from solver import apply_fixed, get_fixed_mask, optimize_schedule
+from value_utils import ScoringContext, get_presence_spread, get_scoring_context, get_weights
+
+# Maximum number of free persons at a service, as all 2^n teams are listed
+MAX_FREE_PERSONS = 20
+
+
+class ExactResult(BaseModel):
+    """
+    This class represents the outcome of branch-and-bound. If the search
+    finished, the schedule is optimal and the lower bound equals its score.
+    Otherwise the gap tells how far from optimal the schedule may be.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    duties: np.ndarray
+    score: float
+    lower_bound: float
+    optimal: bool
+    n_nodes: int
+    duration: float
+
+    @property
+    def gap(self) -> float:
+        """
+        The score minus the lower bound.
+        """
+        return self.score - self.lower_bound
+
+
+################################################
+# -------------- Service teams --------------- #
+################################################
+
+def get_service_teams(context: ScoringContext, availability: np.ndarray,
+                      service: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lists every team that can be present at a service, i.e. every subset of
+    the free persons together with the persons who are present ("ü"), and
+    the part of the score that only depends on that service: the number of
+    persons, the role distribution and the linear preferences.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+        service (int): Column index of the service.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The teams as a matrix of zeros and ones
+            with a row per team, and the cost of each team, sorted from low to
+            high cost.
+    """
+    column = availability[:, service]
+    free_persons = np.flatnonzero((column != -1) & (column != 1))
+    if len(free_persons) > MAX_FREE_PERSONS:
+        raise ValueError(f"Service {service} has {len(free_persons)} free persons, "
+                         f"at most {MAX_FREE_PERSONS} are supported.")
+
+    # Every subset of the free persons, on top of the persons who are present
+    subsets = (np.arange(2 ** len(free_persons))[:, None] >> np.arange(len(free_persons))) & 1
+    teams = np.tile((column == 1).astype(int), (len(subsets), 1))
+    teams[:, free_persons] = subsets
+
+    weights = get_weights(context.rules, len(column))
+    n_rows = len(context.person_stats_counter)
+    row_weights = np.array([weights["n_persons"]] + [weights["role_distribution"]] * (n_rows - 1))
+
+    diff = teams @ context.person_stats_counter.T - context.ideal_person_stats[:, service]
+    costs = (diff * diff) @ row_weights + weights["preferences"] * (teams @ context.cost_matrix[:, service])
+
+    order = np.argsort(costs, kind="stable")
+    return teams[order], costs[order]
+
+def get_spread_bounds(lower: np.ndarray, upper: np.ndarray,
+                      totals: np.ndarray) -> np.ndarray:
+    """
+    Returns, for each total, the minimal n_times_present term of integer
+    presence counts between the given bounds that add up to that total. The
+    minimum is reached by raising the lowest counts first.
+
+    Args:
+        lower (np.ndarray): Lower bound of the presence of each person.
+        upper (np.ndarray): Upper bound of the presence of each person.
+        totals (np.ndarray): The totals of the presence.
+
+    Returns:
+        np.ndarray: The presence spread (see get_presence_spread) for each
+            total, or infinity if the total can't be reached.
+    """
+    n_persons = len(lower)
+    totals = np.asarray(totals)
+
+    # The counts when every count is raised to a level, within its bounds
+    levels = np.arange(lower.min(), upper.max() + 1)
+    clipped = np.clip(levels[:, None], lower, upper)
+    level_totals = clipped.sum(axis=1)
+    level_squares = (clipped * clipped).sum(axis=1)
+
+    # The highest level that doesn't exceed the total, the rest of the total
+    # raises counts at that level by one
+    k = np.clip(np.searchsorted(level_totals, totals, side="right") - 1, 0, len(levels) - 1)
+    squares = level_squares[k] + (totals - level_totals[k]) * (2 * levels[k] + 1)
+
+    feasible = (totals >= lower.sum()) & (totals <= upper.sum())
+    return np.where(feasible, n_persons * squares - totals * totals, np.inf)
+
+def get_suffix_costs(tables: list[tuple[np.ndarray, np.ndarray]],
+                     added_presence: list[np.ndarray]) -> list[np.ndarray]:
+    """
+    Returns, for each service, the cheapest total cost of the teams at that
+    service and all later services, for every amount of presence that these
+    teams add.
+
+    Args:
+        tables (list[tuple[np.ndarray, np.ndarray]]): The teams and their
+            costs at each service.
+        added_presence (list[np.ndarray]): The presence each team adds.
+
+    Returns:
+        list[np.ndarray]: For each service, and after the last service, the
+            cheapest cost indexed by the added presence, infinity where the
+            presence can't be added.
+    """
+    suffix_costs = [np.zeros(1)]
+    for (_, costs), added in zip(reversed(tables), reversed(added_presence)):
+        # Cheapest team for each amount of added presence at this service
+        cheapest = np.full(added.max() + 1, np.inf)
+        np.minimum.at(cheapest, added, costs)
+
+        # Combine with the later services
+        later = suffix_costs[0]
+        combined = np.full(len(cheapest) + len(later) - 1, np.inf)
+        for amount in np.flatnonzero(np.isfinite(cheapest)):
+            window = combined[amount:amount + len(later)]
+            np.minimum(window, cheapest[amount] + later, out=window)
+        suffix_costs.insert(0, combined)
+
+    return suffix_costs
+
+
+def get_interchangeable_groups(context: ScoringContext,
+                               availability: np.ndarray) -> list[np.ndarray]:
+    """
+    Groups the persons whose role, preferences, costs and availability are
+    all the same, so swapping their duties doesn't change the score.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+
+    Returns:
+        list[np.ndarray]: The person indices of each group.
+    """
+    profiles = np.hstack([context.person_stats_counter.T, context.ideal_service_stats.T,
+                          context.cost_matrix, availability])
+    _, labels = np.unique(profiles, axis=0, return_inverse=True)
+    return [np.flatnonzero(labels.ravel() == label) for label in np.unique(labels)]
+
+
+################################################
+# ------------- Branch and bound ------------- #
+################################################
+
+def solve_exact(context: ScoringContext, availability: np.ndarray,
+                duties: np.ndarray = None, time_limit: float = 60,
+                max_nodes: int = None, max_memo: int = 10 ** 6,
+                verbose: bool = False) -> ExactResult:
+    """
+    Finds an optimal schedule with branch-and-bound, assigning a team to one
+    service after the other. The partial schedule with the lowest bound is
+    searched first. The score of a partial schedule is bounded from below
+    by:
+        - the cost of the assigned teams plus the cheapest cost of teams at
+          the remaining services, as the number of persons, the role
+          distribution and the linear preferences decompose per service,
+        - the n_times_present term of the most even presence that the free
+          cells of the remaining services can still give. Both are taken for
+          the same total presence, so the bound accounts for more persons
+          per service making the presence more even,
+        - the "om de week" term of the assigned services, which can only
+          grow.
+    Partial schedules with the same presence counts after the same service
+    have the same remaining cost, so only the cheapest one is searched.
+    Persons with the same role, preferences and availability can be swapped,
+    so their counts are compared as a sorted group.
+
+    If the time or node limit is reached, the best schedule found is
+    returned with the lowest bound of the partial schedules that are left.
+    That bound rises as the search goes on, so a longer search gives a
+    smaller gap.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+        duties (np.ndarray, optional): A schedule to start from, e.g. from a
+            heuristic. Its fixed cells are set as in the availability.
+            Defaults to the cheapest team at every service.
+        time_limit (float, optional): The budget in seconds, or None for no
+            time limit. Defaults to 60.
+        max_nodes (int, optional): The budget in searched partial schedules.
+            Defaults to None, no limit.
+        max_memo (int, optional): The maximal number of remembered partial
+            schedules. Defaults to 10^6.
+        verbose (bool, optional): Whether to print improvements.
+
+    Returns:
+        ExactResult: The best schedule, its score and the lower bound.
+    """
+    t_start = time.perf_counter()
+    availability = np.asarray(availability)
+    n_persons, n_services = availability.shape
+    weights = get_weights(context.rules, n_persons)
+
+    tables = [get_service_teams(context, availability, s) for s in range(n_services)]
+
+    # Presence and week counts of the persons who are present ("ü"), and what
+    # each team adds to them
+    forced = (availability == 1).astype(int)
+    free = (~get_fixed_mask(availability)).astype(int)
+    present_counts = context.service_stats_counter[:, 0]
+    week_persons = np.flatnonzero(context.ideal_service_stats[2])
+    even_counts = context.service_stats_counter[:, 3]
+    odd_counts = context.service_stats_counter[:, 4]
+
+    additions = []
+    for s, (teams, _) in enumerate(tables):
+        added = teams - forced[:, s]
+        additions.append((added * present_counts[s],
+                          added[:, week_persons] * even_counts[s],
+                          added[:, week_persons] * odd_counts[s]))
+
+    # Cheapest cost of the services from each service onwards, in total and
+    # per amount of added presence
+    suffix_costs = get_suffix_costs(tables, [added.sum(axis=1) for added, _, _ in additions])
+    suffix_min_costs = [float(costs.min()) for costs in suffix_costs]
+
+    # How much the free cells from each service onwards can add to presence
+    free_presence = free * present_counts
+    suffix_free = np.cumsum(free_presence[:, ::-1], axis=1)[:, ::-1]
+    suffix_free = np.hstack([suffix_free, np.zeros((n_persons, 1), dtype=int)])
+
+    def get_bound(s, presence, even, odd, cost):
+        # Lower bound of every schedule completing this partial schedule
+        costs = suffix_costs[s]
+        totals = presence.sum() + np.arange(len(costs))
+        spreads = get_spread_bounds(presence, presence + suffix_free[:, s], totals)
+        weeks = np.minimum(even, odd).sum()
+        return (cost + np.min(costs + weights["n_times_present"] * spreads)
+                + weights["preferences"] * weeks)
+
+    def get_total(presence, even, odd, cost):
+        # Score of a complete schedule
+        spread = get_presence_spread(presence)
+        weeks = np.minimum(even, odd).sum()
+        return cost + weights["n_times_present"] * spread + weights["preferences"] * weeks
+
+    # The incumbent: the given schedule or the cheapest team at each service.
+    # A given schedule may violate the availability, and would then score
+    # below the optimum
+    if duties is None:
+        duties = np.stack([teams[0] for teams, _ in tables], axis=1)
+    duties = apply_fixed(duties, availability)
+    best = {"duties": duties, "score": context.score(duties)}
+
+    # Groups of persons that can be swapped, and which persons have "om de
+    # week" counts
+    groups = get_interchangeable_groups(context, availability)
+    is_week_person = np.isin(np.arange(n_persons), week_persons)
+
+    def get_key(s, presence, even, odd):
+        # Partial schedules with the same key have the same remaining cost
+        counts = np.stack([presence, np.zeros(n_persons, dtype=int),
+                           np.zeros(n_persons, dtype=int)], axis=1)
+        counts[is_week_person, 1] = even
+        counts[is_week_person, 2] = odd
+        return (s, b"".join(np.sort(counts[group].view([("", int)] * 3), axis=0).tobytes()
+                            for group in groups))
+
+    # The open partial schedules, lowest bound first. A "node" entry is a
+    # partial schedule of the services before s. A "teams" entry stands for
+    # the teams t, t + 1, ... at service s of a node, which are sorted by
+    # cost, so their bound is the larger of the node's bound and base plus
+    # the cost of team t. Popping it bounds team t and pushes the rest, so
+    # every node adds at most two entries. The choices are a linked list of
+    # (team, previous choices).
+    presence = (forced * present_counts).sum(axis=1)
+    even = (forced[week_persons] * even_counts).sum(axis=1)
+    odd = (forced[week_persons] * odd_counts).sum(axis=1)
+    heap = [(get_bound(0, presence, even, odd, 0.0), 0, 0, "node", 0, presence, even, odd,
+             0.0, None)]
+    n_entries = 1
+    n_nodes = 1
+    memo = {}
+    aborted = False
+
+    def push(entry_bound, kind, s, *entry):
+        nonlocal n_entries
+        if entry_bound < best["score"] - 1e-9:
+            # Deeper entries first among equal bounds, to reach schedules
+            heapq.heappush(heap, (entry_bound, -s, n_entries, kind, s, *entry))
+            n_entries += 1
+
+    while heap and heap[0][0] < best["score"] - 1e-9:
+        if ((time_limit is not None and time.perf_counter() - t_start >= time_limit)
+                or (max_nodes is not None and n_nodes >= max_nodes)):
+            aborted = True
+            break
+
+        bound, _, _, kind, s, presence, even, odd, cost, data = heapq.heappop(heap)
+
+        if kind == "node":
+            if s == n_services:
+                score = get_total(presence, even, odd, cost)
+                if score < best["score"] - 1e-9:
+                    choices = []
+                    while data is not None:
+                        t, data = data
+                        choices.append(t)
+                    best["score"] = score
+                    best["duties"] = np.stack([tables[j][0][t]
+                                               for j, t in enumerate(choices[::-1])], axis=1)
+                    if verbose:
+                        print(f"nodes = {n_nodes}, score = {score}")
+                continue
+
+            # Only the cheapest way to reach these counts needs to be searched
+            key = get_key(s, presence, even, odd)
+            if key in memo and memo[key] < cost - 1e-9:
+                continue
+
+            base = (cost + suffix_min_costs[s + 1]
+                    + weights["preferences"] * np.minimum(even, odd).sum())
+            push(max(bound, base + tables[s][1][0]), "teams", s, presence, even, odd, cost,
+                 (0, bound, base, data))
+            continue
+
+        # The next team of a node, and the teams after it
+        t, node_bound, base, choices = data
+        team_costs = tables[s][1]
+        if t + 1 < len(team_costs):
+            push(max(node_bound, base + team_costs[t + 1]), "teams", s, presence, even, odd,
+                 cost, (t + 1, node_bound, base, choices))
+
+        added_presence, added_even, added_odd = additions[s]
+        child = (presence + added_presence[t], even + added_even[t], odd + added_odd[t],
+                 cost + team_costs[t])
+        n_nodes += 1
+        if s + 1 < n_services:
+            key = get_key(s + 1, *child[:3])
+            if key in memo and memo[key] <= child[3] + 1e-9:
+                continue
+            if key in memo or len(memo) < max_memo:
+                memo[key] = child[3]
+        push(get_bound(s + 1, *child), "node", s + 1, *child, (t, choices))
+
+    # Every schedule that is left completes an open entry, so none scores
+    # below the lowest bound in the heap
+    lower_bound = min(best["score"], heap[0][0]) if aborted else best["score"]
+    return ExactResult(duties=best["duties"], score=best["score"], lower_bound=lower_bound,
+                       optimal=not aborted, n_nodes=n_nodes,
+                       duration=time.perf_counter() - t_start)
+
+
+if __name__ == "__main__":
+    # The first few weeks of the rooster, with some persons unavailable
+    services_ = dict(list(services_dict.items())[:3])
+    rng_ = np.random.default_rng(0)
+    availability_ = np.where(rng_.random((len(kerkenraad), len(services_to_list(services_)))) < 0.3,
+                             -1, 0)
+    scoring_context = get_scoring_context(kerkenraad, services_, Rules(), availability_)
+
+    # Start from a heuristic schedule, so it only has to be proven optimal
+    duties_ = optimize_schedule(scoring_context, availability_, method="tabu_search", seed=0)
+    exact_result = solve_exact(scoring_context, availability_, duties_, verbose=True)
+    print(f"score = {exact_result.score}, gap = {exact_result.gap}, "
+          f"optimal = {exact_result.optimal}, nodes = {exact_result.n_nodes}, "
+          f"duration = {exact_result.duration}")
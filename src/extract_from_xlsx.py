@@ -5,7 +5,7 @@ Created on Wed Mar 19 20:24:13 2025
 @author: Levi
 """
 
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import datetime
 import numpy as np
 import openpyxl
@@ -34,6 +34,7 @@ def extract_availability(ws) -> np.ndarray:
     - -1 for None (available)
     - 0 for "X" or "b" (unavailable)
     - 1 for "ü" (present)
+    - 2 for "~" (available, but would very much prefer not to)
 
     Args:
         ws (openpyxl.worksheet): The worksheet containing the schedule.
@@ -67,6 +68,8 @@ def extract_availability(ws) -> np.ndarray:
                 availability[(i - 2) // 2][j] = -1  # Unavailable
             elif value == "ü":
                 availability[(i - 2) // 2][j] = 1  # Present
+            elif value == "~":
+                availability[(i - 2) // 2][j] = 2  # Erg voorkeur niet
             else:
                 # Log invalid values and ignore them
                 print(f"Invalid value '{value}' at position ({i}, {j}). It will "
@@ -75,7 +78,8 @@ def extract_availability(ws) -> np.ndarray:
 
     return availability
 
-def extract_services(ws) -> Dict[datetime, List[float]]:
+def extract_services(ws, start_date: Optional[datetime] = None
+                     ) -> Dict[datetime, List[float]]:
     """
     Extracts service data from the worksheet and returns a dictionary mapping
     dates to services.
@@ -85,8 +89,13 @@ def extract_services(ws) -> Dict[datetime, List[float]]:
     - 1 for service 'a'
     - 0.5 for other service types.
 
+    The worksheet only contains the day and month of each date. If a start
+    date is given, the dates are converted to datetimes, starting in the year
+    of the start date and moving to the next year when the month wraps around.
+
     Args:
         ws (openpyxl.worksheet): The worksheet containing the service information.
+        start_date (Optional[datetime]): The start date of the schedule.
 
     Returns:
         dict: A dictionary where the keys are dates and the values are lists of
@@ -98,6 +107,10 @@ def extract_services(ws) -> Dict[datetime, List[float]]:
     # Initialize the services dictionary
     services_dict = {}
 
+    # Initialize the year and month of the previous date
+    if start_date is not None:
+        year, month = start_date.year, start_date.month
+
     # Iterate over the first two rows (date and service type) in each column
     for col in ws.iter_cols(min_col=2, max_col=1 + n_cols, max_row=2,
                              values_only=True):
@@ -112,6 +125,12 @@ def extract_services(ws) -> Dict[datetime, List[float]]:
         # Add the service to the dictionary, with date as key and service as value
         if col[0] is not None:
             date = col[0]
+            if start_date is not None and isinstance(date, str):
+                date = datetime.strptime(date, "%d-%m")
+                if date.month < month:
+                    year += 1
+                month = date.month
+                date = date.replace(year=year)
             services_dict[date] = [service]
         else:
             services_dict[date].append(service)
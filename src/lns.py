@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Large neighbourhood search over windows of church dates and roles.
+"""
+
+import math
+import time
+
+import numpy as np
+
+from create_xlsx import kerkenraad, services_dict
+from date_utils import get_date_groups
+from exact import get_service_teams
+from rules import Rules
+from solver import SolverResult, apply_fixed, get_greedy_duties
+from team_patterns import get_role_groups, get_team_table
+from telemetry import SolverTrace
+from value_utils import ScoringContext, get_presence_spread, get_scoring_context, get_weights
+
+# The types of windows, i.e. which cells are freed together
+WINDOW_TYPES = ("dates", "role")
+
+# The ways to solve the schedule within a window
+SUB_SOLVERS = ("exact", "teams")
+
+
+def get_windows(context: ScoringContext, dates: list[list[int]], n_dates: int,
+                n_role_dates: int, window_types=WINDOW_TYPES) -> list[np.ndarray]:
+    """
+    Returns the cells of every window. A "dates" window has all cells of
+    n_dates consecutive church dates, a "role" window the cells of the
+    persons of one role at n_role_dates consecutive church dates.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        dates (list[list[int]]): The column indices of the services of every
+            church date, in chronological order.
+        n_dates (int): The number of church dates per "dates" window.
+        n_role_dates (int): The number of church dates per "role" window.
+        window_types (tuple[str], optional): The types of windows to use.
+
+    Returns:
+        list[np.ndarray]: Boolean matrix per window that is True for the
+            cells of that window.
+    """
+    shape = (context.n_persons, context.n_services)
+    persons = {"dates": [np.arange(context.n_persons)],
+               "role": get_role_groups(context.person_stats_counter)}
+    spans = {"dates": n_dates, "role": n_role_dates}
+
+    windows = []
+    for window_type in window_types:
+        span = spans[window_type]
+        for group in persons[window_type]:
+            for start in range(max(len(dates) - span + 1, 1)):
+                window = np.zeros(shape, dtype=bool)
+                for columns in dates[start:start + span]:
+                    window[np.ix_(group, columns)] = True
+                windows.append(window)
+
+    return windows
+
+def get_window_tables(context: ScoringContext, availability: np.ndarray,
+                      services: np.ndarray, sub_solver: str = "teams",
+                      max_extra_score: float = 0) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Returns the teams and their costs at each service of a window, sorted
+    from low to high cost.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability, in which the cells
+            outside the window are fixed.
+        services (np.ndarray): Column indices of the services of the window.
+        sub_solver (str, optional): One of SUB_SOLVERS. "exact" lists every
+            team, "teams" the teams of the team tables. Defaults to "teams".
+        max_extra_score (float, optional): How much worse than the best role
+            score the teams of the team tables may be. Defaults to 0.
+
+    Returns:
+        list[tuple[np.ndarray, np.ndarray]]: The teams and costs per service.
+    """
+    if sub_solver == "exact":
+        return [get_service_teams(context, availability, service) for service in services]
+
+    tables = []
+    for service in services:
+        table = get_team_table(context.person_stats_counter, context.ideal_person_stats,
+                               context.cost_matrix, context.rules, availability, service,
+                               max_extra_score)
+        tables.append((table.teams, table.costs))
+    return tables
+
+def solve_window(context: ScoringContext, duties: np.ndarray, services: np.ndarray,
+                 tables: list[tuple[np.ndarray, np.ndarray]],
+                 max_combinations: int = 10 ** 6,
+                 chunk_size: int = 2 ** 15) -> tuple[np.ndarray, int]:
+    """
+    Finds the best combination of teams at the services of a window, with
+    all other services kept as in the duties. Every combination is scored,
+    a chunk of combinations at a time: the cost of the teams plus the
+    n_times_present and "om de week" terms, which only need the presence
+    and week counts of every person. If there are more than
+    max_combinations, only the cheapest teams of the largest tables are
+    used.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        duties (np.ndarray): The current duties.
+        services (np.ndarray): Column indices of the services of the window.
+        tables (list[tuple[np.ndarray, np.ndarray]]): The teams and their
+            costs at each service of the window, sorted by cost.
+        max_combinations (int, optional): The maximal number of combinations.
+            Defaults to 10^6.
+        chunk_size (int, optional): The number of combinations scored at
+            once. Defaults to 2^15.
+
+    Returns:
+        tuple[np.ndarray, int]: The duties with the best combination, and
+            the number of scored combinations.
+    """
+    weights = get_weights(context.rules, duties.shape[0])
+
+    # Halve the largest tables until there are few enough combinations
+    sizes = [len(costs) for _, costs in tables]
+    while math.prod(sizes) > max_combinations:
+        largest = int(np.argmax(sizes))
+        sizes[largest] = (sizes[largest] + 1) // 2
+    n_combinations = math.prod(sizes)
+
+    # Presence and week counts outside the window, and what each team adds
+    counters = context.service_stats_counter[:, [0, 3, 4]]
+    outside = np.array(duties, dtype=int)
+    outside[:, services] = 0
+    base_counts = outside @ counters
+    added_counts = [teams[:size, :, None] * counters[service]
+                    for service, (teams, _), size in zip(services, tables, sizes)]
+    team_costs = [costs[:size] for (_, costs), size in zip(tables, sizes)]
+    week_persons = context.ideal_service_stats[2]
+
+    best_total = math.inf
+    best_index = 0
+    for start in range(0, n_combinations, chunk_size):
+        indices = np.unravel_index(np.arange(start, min(start + chunk_size, n_combinations)),
+                                   sizes)
+        counts = base_counts + sum(added[index] for added, index in zip(added_counts, indices))
+        totals = sum(costs[index] for costs, index in zip(team_costs, indices))
+        totals = (totals
+                  + weights["n_times_present"] * get_presence_spread(counts[..., 0])
+                  + weights["preferences"] * (np.minimum(counts[..., 1], counts[..., 2])
+                                              @ week_persons))
+
+        k = int(np.argmin(totals))
+        if totals[k] < best_total:
+            best_total, best_index = totals[k], start + k
+
+    solution = np.array(duties, dtype=int)
+    choices = np.unravel_index(best_index, sizes)
+    for service, (teams, _), choice in zip(services, tables, choices):
+        solution[:, service] = teams[choice]
+
+    return solution, n_combinations
+
+def trace_windows(trace: SolverTrace, context: ScoringContext, duties: np.ndarray,
+                  score: float, n_windows: int, t_start: float, n_evaluations: int,
+                  n_accepted: int):
+    """
+    Records the progress of large neighbourhood search to the trace. The
+    working schedule is always the best.
+    """
+    terms = context.score_breakdown(duties).weighted_terms if trace.terms else None
+    trace.record("lns", n_windows, time.perf_counter() - t_start, score, score,
+                 n_evaluations, n_accepted, terms)
+
+def large_neighbourhood_search(context: ScoringContext, availability: np.ndarray,
+                               duties: np.ndarray = None, dates: list[list[int]] = None,
+                               n_dates: int = 1, n_role_dates: int = 2,
+                               window_types=WINDOW_TYPES, sub_solver: str = "teams",
+                               max_extra_score: float = 2, max_combinations: int = 10 ** 6,
+                               time_limit: float = None, min_improvement: float = 1,
+                               seed: int = None, trace: SolverTrace = None,
+                               verbose: bool = False) -> SolverResult:
+    """
+    Improves a schedule by re-solving windows of it. All cells of a window
+    are freed, every other cell keeps its duty, and the best combination of
+    teams at the services of the window is kept if it improves the score.
+    Every pass visits the windows in random order. Stops when a pass
+    improves the score by less than min_improvement.
+
+    A window moves many cells at once, further than the flips of local
+    search, while the windows are small enough to list every combination.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+        duties (np.ndarray, optional): The duties to start from. Defaults to
+            the greedy schedule.
+        dates (list[list[int]], optional): The column indices of the
+            services of every church date, see date_utils.get_date_groups.
+            Defaults to a date per service.
+        n_dates (int, optional): The number of church dates per "dates"
+            window. Defaults to 1.
+        n_role_dates (int, optional): The number of church dates per "role"
+            window. Defaults to 2.
+        window_types (tuple[str], optional): The types of windows to use.
+        sub_solver (str, optional): One of SUB_SOLVERS. "exact" tries every
+            team at the services of the window, "teams" only the teams of the
+            team tables. Defaults to "teams".
+        max_extra_score (float, optional): How much worse than the best role
+            score the teams of the team tables may be. A little room lets the
+            roles give way to fairness. Defaults to 2.
+        max_combinations (int, optional): The maximal number of combinations
+            per window, above which only the cheapest teams are tried.
+            Defaults to 10^6.
+        time_limit (float, optional): The budget in seconds. Defaults to
+            None, no limit.
+        min_improvement (float, optional): Minimal improvement of a pass to
+            continue. Defaults to 1.
+        seed (int, optional): Seed of the random number generator.
+        trace (SolverTrace, optional): Records the progress after the
+            windows, at most once per interval of the trace, with the number
+            of windows as iteration and the improved windows as accepted.
+        verbose (bool, optional): Whether to print the score of every pass.
+
+    Returns:
+        SolverResult: The improved schedule and its score, with the number
+            of scored combinations as the number of evaluations.
+    """
+    t_start = time.perf_counter()
+    if sub_solver not in SUB_SOLVERS:
+        raise ValueError(f"Unknown sub solver '{sub_solver}', expected one of {SUB_SOLVERS}.")
+    rng = np.random.default_rng(seed)
+    availability = np.asarray(availability)
+
+    if duties is None:
+        duties = get_greedy_duties(context, availability)
+    duties = apply_fixed(duties, availability)
+    score = context.score(duties)
+
+    if dates is None:
+        dates = [[service] for service in range(context.n_services)]
+    windows = get_windows(context, dates, n_dates, n_role_dates, window_types)
+
+    n_evaluations = 0
+    n_windows = 0
+    n_accepted = 0
+    out_of_time = False
+    while not out_of_time:
+        start_score = score
+
+        for index in rng.permutation(len(windows)).tolist():
+            if time_limit is not None and time.perf_counter() - t_start >= time_limit:
+                out_of_time = True
+                break
+
+            # Outside the window, the duties are fixed like "ü" and "x"
+            window = windows[index]
+            sub_availability = np.where(window, availability, np.where(duties == 1, 1, -1))
+            services = np.flatnonzero(window.any(axis=0))
+            tables = get_window_tables(context, sub_availability, services, sub_solver,
+                                       max_extra_score)
+
+            solution, n_combinations = solve_window(context, duties, services, tables,
+                                                    max_combinations)
+            n_evaluations += n_combinations
+
+            solution_score = context.score(solution)
+            if solution_score < score - 1e-9:
+                duties, score = solution, solution_score
+                n_accepted += 1
+
+            n_windows += 1
+            if trace is not None and trace.due():
+                trace_windows(trace, context, duties, score, n_windows, t_start,
+                              n_evaluations, n_accepted)
+
+        if verbose:
+            print(f"duration = {time.perf_counter() - t_start}, score = {score}")
+
+        if start_score - score < min_improvement:
+            break
+
+    if trace is not None:
+        trace_windows(trace, context, duties, score, n_windows, t_start, n_evaluations,
+                      n_accepted)
+
+    return SolverResult(duties=duties, score=score, n_evaluations=n_evaluations,
+                        duration=time.perf_counter() - t_start)
+
+
+if __name__ == "__main__":
+    scoring_context = get_scoring_context(kerkenraad, services_dict, Rules())
+    availability_ = np.zeros((scoring_context.n_persons, scoring_context.n_services),
+                             dtype=int)
+
+    lns_result = large_neighbourhood_search(scoring_context, availability_,
+                                            dates=get_date_groups(services_dict),
+                                            seed=0, verbose=True)
+    print(scoring_context.score_breakdown(lns_result.duties).weighted_terms)
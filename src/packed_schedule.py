@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Bit-packed schedules, scored by counting bits with popcount.
+"""
+
+import numpy as np
+
+from create_xlsx import kerkenraad, services_dict
+from rules import Rules
+from value_utils import ScoringContext, get_score_from_stats, get_scoring_context
+
+
+################################################
+# ------------- Bitset functions ------------- #
+################################################
+
+def pack_bits(matrix: np.ndarray) -> np.ndarray:
+    """
+    Packs the last axis of a matrix of zeros and ones into uint64 words.
+    Bit k of word w holds element 64*w + k.
+
+    Args:
+        matrix (np.ndarray): Array of zeros and ones.
+
+    Returns:
+        np.ndarray: Array of the same leading shape with the last axis
+            replaced by ceil(n / 64) words.
+    """
+    matrix = np.asarray(matrix) != 0
+    n = matrix.shape[-1]
+    n_words = (n + 63) // 64
+
+    # Pad the last axis to a whole number of words
+    padding = [(0, 0)] * (matrix.ndim - 1) + [(0, 64 * n_words - n)]
+    matrix = np.pad(matrix, padding)
+
+    packed = np.packbits(matrix, axis=-1, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8")
+
+def unpack_bits(words: np.ndarray, n: int) -> np.ndarray:
+    """
+    Unpacks uint64 words into a matrix of zeros and ones.
+
+    Args:
+        words (np.ndarray): Array of packed words.
+        n (int): The number of elements in the last axis.
+
+    Returns:
+        np.ndarray: Array of zeros and ones.
+    """
+    as_bytes = np.ascontiguousarray(words, dtype="<u8").view(np.uint8)
+    bits = np.unpackbits(as_bytes, axis=-1, count=n, bitorder="little")
+    return bits.astype(int)
+
+if hasattr(np, "bitwise_count"):
+    def popcount(words: np.ndarray) -> np.ndarray:
+        """
+        Returns the number of set bits, summed over the last axis.
+        """
+        return np.bitwise_count(words).sum(axis=-1, dtype=int)
+else:
+    # Older numpy versions don't have bitwise_count, so use a lookup table
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        """
+        Returns the number of set bits, summed over the last axis.
+        """
+        as_bytes = np.ascontiguousarray(words, dtype="<u8").view(np.uint8)
+        return _BYTE_COUNTS[as_bytes].sum(axis=-1, dtype=int)
+
+
+################################################
+# -------------- Packed schedule ------------- #
+################################################
+
+class PackedSchedule:
+    """
+    This class represents a schedule of which each person's row and each
+    service's column are stored as packed uint64 bitsets. Both are kept up to
+    date, so counting over persons and counting over services are both an
+    AND followed by a popcount.
+    """
+    def __init__(self, n_persons: int, n_services: int):
+        self.n_persons = n_persons
+        self.n_services = n_services
+        self.rows = np.zeros((n_persons, (n_services + 63) // 64), dtype=np.uint64)
+        self.columns = np.zeros((n_services, (n_persons + 63) // 64), dtype=np.uint64)
+
+    @classmethod
+    def from_array(cls, matrix: np.ndarray) -> "PackedSchedule":
+        """
+        Returns a packed schedule with the presence of the given matrix.
+
+        Args:
+            matrix (np.ndarray): Matrix of zeros and ones, with a row per
+                person and a column per service.
+        """
+        n_persons, n_services = matrix.shape
+        packed = cls(n_persons, n_services)
+        packed.rows = pack_bits(matrix)
+        packed.columns = pack_bits(np.transpose(matrix))
+        return packed
+
+    def to_array(self) -> np.ndarray:
+        """
+        Returns the schedule as a matrix of zeros and ones.
+        """
+        return unpack_bits(self.rows, self.n_services)
+
+    def get(self, person: int, service: int) -> int:
+        """
+        Returns whether the given person is present at the given service.
+        """
+        return int(self.rows[person, service >> 6] >> np.uint64(service & 63)) & 1
+
+    def flip(self, person: int, service: int):
+        """
+        Flips the presence of the given person at the given service.
+        """
+        self.rows[person, service >> 6] ^= np.uint64(1 << (service & 63))
+        self.columns[service, person >> 6] ^= np.uint64(1 << (person & 63))
+
+    def set(self, person: int, service: int, value: int):
+        """
+        Sets the presence of the given person at the given service.
+        """
+        if self.get(person, service) != int(value):
+            self.flip(person, service)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes used by the bitsets.
+        """
+        return self.rows.nbytes + self.columns.nbytes
+
+    def presence_counts(self) -> np.ndarray:
+        """
+        Returns how often each person is present.
+        """
+        return popcount(self.rows)
+
+    def service_counts(self, service_masks: np.ndarray) -> np.ndarray:
+        """
+        Counts, for each mask over the services, how many of the masked
+        services each person is present at.
+
+        Args:
+            service_masks (np.ndarray): Packed masks of shape (masks, words).
+
+        Returns:
+            np.ndarray: Counts of shape (masks, persons).
+        """
+        return popcount(self.rows[None, :, :] & service_masks[:, None, :])
+
+    def role_counts(self, role_masks: np.ndarray) -> np.ndarray:
+        """
+        Counts, for each mask over the persons, how many of the masked persons
+        are present at each service.
+
+        Args:
+            role_masks (np.ndarray): Packed masks of shape (masks, words).
+
+        Returns:
+            np.ndarray: Counts of shape (masks, services).
+        """
+        return popcount(self.columns[None, :, :] & role_masks[:, None, :])
+
+    def score(self, context: ScoringContext) -> float:
+        """
+        Calculates the score of the schedule with the counter matrices of the
+        given scoring context packed as masks, which are only packed on the
+        first call for the context.
+
+        Args:
+            context (ScoringContext): The scoring context of the schedule.
+
+        Returns:
+            float: The score of the schedule. Lower is better.
+        """
+        role_masks, service_masks, cost_planes = get_packed_masks(context)
+        person_stats = self.role_counts(role_masks)
+        service_stats = self.service_counts(service_masks)
+
+        return get_score_from_stats(person_stats, context.ideal_person_stats,
+                                    service_stats, context.ideal_service_stats,
+                                    context.rules, self.linear_cost(cost_planes))
+
+    def linear_cost(self, cost_planes: np.ndarray) -> int:
+        """
+        Returns the sum of a cost matrix over the schedule, with the cost
+        matrix given as packed bit planes.
+
+        Args:
+            cost_planes (np.ndarray): Packed bit planes of shape
+                (planes, persons, words), plane b holding bit b of the costs.
+
+        Returns:
+            int: The linear cost of the schedule.
+        """
+        counts = popcount(self.rows[None, :, :] & cost_planes).sum(axis=1)
+        return int(np.sum(counts << np.arange(len(cost_planes))))
+
+def get_packed_masks(context: ScoringContext
+                     ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Packs the counter matrices of a scoring context as bitset masks. The rows
+    of the person stats counter become masks over the persons, the columns of
+    the service stats counter become masks over the services. The cost
+    matrix, which holds small nonnegative integers, is split into bit planes
+    of which each row is a mask over the services.
+
+    The masks are built once per scoring context and kept in it.
+
+    Args:
+        context (ScoringContext): The scoring context.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The role masks, the service
+            masks and the cost planes.
+    """
+    if context.packed_masks is not None:
+        return context.packed_masks
+
+    role_masks = pack_bits(context.person_stats_counter)
+    service_masks = pack_bits(context.service_stats_counter.T)
+
+    cost_matrix = context.cost_matrix.astype(np.int64)
+    n_planes = max(int(cost_matrix.max()).bit_length(), 1)
+    cost_planes = pack_bits(np.stack([(cost_matrix >> b) & 1 for b in range(n_planes)]))
+
+    context.packed_masks = (role_masks, service_masks, cost_planes)
+    return context.packed_masks
+
+
+if __name__ == "__main__":
+    scoring_context = get_scoring_context(kerkenraad, services_dict, Rules())
+    rng = np.random.default_rng(0)
+    matrix_ = rng.integers(0, 2, (scoring_context.n_persons, scoring_context.n_services))
+
+    packed_ = PackedSchedule.from_array(matrix_)
+    print(f"bytes: {matrix_.nbytes} -> {packed_.nbytes}")
+    print(packed_.score(scoring_context))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel multi-start solving in worker processes.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from pydantic import BaseModel
+
+from create_xlsx import kerkenraad, services_dict
+from rules import Rules
+from solver import (MOVE_TYPES, Neighbourhood, SolverResult, apply_fixed,
+                    get_fixed_mask, get_greedy_duties, run_method)
+from value_utils import IncrementalScorer, ScoringContext, get_scoring_context
+
+
+class WorkerStats(BaseModel):
+    """
+    This class represents what one worker process did during a parallel run.
+    """
+    pid: int
+    n_starts: int
+    n_evaluations: int
+    duration: float
+    best_score: float
+
+class ParallelResult(BaseModel):
+    """
+    This class represents the outcome of a parallel run: the best result of
+    all starts, the score of every start and the stats of every worker.
+    """
+    best: SolverResult
+    scores: list[float]
+    workers: list[WorkerStats]
+    duration: float
+
+
+################################################
+# -------------- Shared memory --------------- #
+################################################
+
+def share_arrays(arrays: dict[str, np.ndarray]
+                 ) -> tuple[list[shared_memory.SharedMemory], dict[str, tuple]]:
+    """
+    Copies arrays into new blocks of shared memory.
+
+    Args:
+        arrays (dict[str, np.ndarray]): The arrays by name.
+
+    Returns:
+        tuple[list[shared_memory.SharedMemory], dict[str, tuple]]: The blocks,
+            which the caller has to close and unlink, and per name the block
+            name, shape and dtype needed to attach to the array.
+    """
+    memories = []
+    specs = {}
+    try:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            memories.append(memory)
+
+            np.ndarray(array.shape, array.dtype, buffer=memory.buf)[...] = array
+            specs[name] = (memory.name, array.shape, array.dtype.str)
+    except BaseException:
+        release_arrays(memories)
+        raise
+
+    return memories, specs
+
+def attach_arrays(specs: dict[str, tuple]
+                  ) -> tuple[list[shared_memory.SharedMemory], dict[str, np.ndarray]]:
+    """
+    Attaches to arrays in shared memory made by share_arrays.
+
+    Args:
+        specs (dict[str, tuple]): Per name the block name, shape and dtype.
+
+    Returns:
+        tuple[list[shared_memory.SharedMemory], dict[str, np.ndarray]]: The
+            blocks, which have to be kept open while the arrays are used, and
+            the arrays by name.
+    """
+    memories = []
+    arrays = {}
+    for name, (memory_name, shape, dtype) in specs.items():
+        memory = shared_memory.SharedMemory(name=memory_name)
+        memories.append(memory)
+        arrays[name] = np.ndarray(shape, dtype, buffer=memory.buf)
+
+    return memories, arrays
+
+def release_arrays(memories: list[shared_memory.SharedMemory]):
+    """
+    Closes and removes blocks of shared memory made by share_arrays.
+    """
+    for memory in memories:
+        memory.close()
+        memory.unlink()
+
+
+################################################
+# ---------------- Workers ------------------- #
+################################################
+
+# The inputs of the worker process, set up once by init_worker
+_worker = {}
+
+def init_worker(specs: dict[str, tuple], rules: Rules, method: str, move_types: tuple,
+                kwargs: dict):
+    """
+    Sets up a worker process: attaches to the shared arrays and builds the
+    neighbourhood, so the starts run by this process don't repeat this.
+    """
+    memories, arrays = attach_arrays(specs)
+    _worker.update(
+        memories=memories,
+        arrays=arrays,
+        rules=rules,
+        method=method,
+        kwargs=kwargs,
+        neighbourhood=Neighbourhood(get_fixed_mask(arrays["availability"]), move_types),
+    )
+
+def run_start(seed: np.random.SeedSequence) -> tuple[int, SolverResult]:
+    """
+    Runs one seeded search in a worker process.
+
+    Args:
+        seed (np.random.SeedSequence): The seed of this start.
+
+    Returns:
+        tuple[int, SolverResult]: The id of the worker process and the result.
+    """
+    arrays = _worker["arrays"]
+    scorer = IncrementalScorer(arrays["person_stats_counter"], arrays["ideal_person_stats"],
+                               arrays["service_stats_counter"], arrays["ideal_service_stats"],
+                               _worker["rules"], arrays["duties"], arrays["cost_matrix"])
+
+    result = run_method(_worker["method"], scorer, _worker["neighbourhood"],
+                        np.random.default_rng(seed), **_worker["kwargs"])
+    return os.getpid(), result
+
+
+################################################
+# ------------- Parallel solving ------------- #
+################################################
+
+def solve_parallel(context: ScoringContext, availability: np.ndarray,
+                   n_workers: int = None, n_starts: int = None,
+                   duties: np.ndarray = None, method: str = "simulated_annealing",
+                   move_types=MOVE_TYPES, seed: int = None,
+                   **kwargs) -> ParallelResult:
+    """
+    Runs independent seeded searches in a pool of worker processes and
+    returns the best result. The availability, the starting duties and the
+    matrices of the scoring context are put in shared memory, so they are
+    not pickled for every start.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+        n_workers (int, optional): The number of worker processes. Defaults
+            to the number of cores.
+        n_starts (int, optional): The number of searches. Defaults to the
+            number of workers.
+        duties (np.ndarray, optional): The duties every search starts from.
+            Defaults to the greedy schedule.
+        method (str, optional): The method of every search. Defaults to
+            "simulated_annealing".
+        move_types (tuple[str], optional): The types of moves to use.
+        seed (int, optional): Seed from which the seeds of the searches are
+            derived.
+        **kwargs: Options of the method, e.g. time_limit.
+
+    Returns:
+        ParallelResult: The best result, the score of every start and the
+            stats of every worker.
+    """
+    t_start = time.perf_counter()
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_starts is None:
+        n_starts = n_workers
+
+    if duties is None:
+        duties = get_greedy_duties(context, availability)
+    duties = apply_fixed(duties, availability)
+
+    memories, specs = share_arrays({
+        "availability": availability,
+        "duties": duties,
+        "person_stats_counter": context.person_stats_counter,
+        "ideal_person_stats": context.ideal_person_stats,
+        "service_stats_counter": context.service_stats_counter,
+        "ideal_service_stats": context.ideal_service_stats,
+        "cost_matrix": context.cost_matrix,
+    })
+
+    try:
+        seeds = np.random.SeedSequence(seed).spawn(n_starts)
+        initargs = (specs, context.rules, method, tuple(move_types), kwargs)
+        with ProcessPoolExecutor(n_workers, initializer=init_worker,
+                                 initargs=initargs) as executor:
+            outcomes = list(executor.map(run_start, seeds))
+    finally:
+        release_arrays(memories)
+
+    # Stats per worker process
+    workers = {}
+    for pid, result in outcomes:
+        if pid not in workers:
+            workers[pid] = WorkerStats(pid=pid, n_starts=0, n_evaluations=0,
+                                       duration=0, best_score=result.score)
+        stats = workers[pid]
+        stats.n_starts += 1
+        stats.n_evaluations += result.n_evaluations
+        stats.duration += result.duration
+        stats.best_score = min(stats.best_score, result.score)
+
+    results = [result for _, result in outcomes]
+    best = min(results, key=lambda result: result.score)
+
+    return ParallelResult(best=best, scores=[result.score for result in results],
+                          workers=list(workers.values()),
+                          duration=time.perf_counter() - t_start)
+
+
+if __name__ == "__main__":
+    scoring_context = get_scoring_context(kerkenraad, services_dict, Rules())
+    availability_ = np.zeros((scoring_context.n_persons, scoring_context.n_services),
+                             dtype=int)
+
+    parallel_result = solve_parallel(scoring_context, availability_, seed=0, time_limit=5)
+    print(f"duration = {parallel_result.duration}, scores = {parallel_result.scores}")
+    for worker_stats in parallel_result.workers:
+        print(worker_stats)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Apr 19 14:03:39 2025
+
+@author: Levi
+"""
+from pydantic import BaseModel
+
+
+class Rules(BaseModel):
+    """
+    This class represents the rules by which the schedule must abide.
+    """
+    n_persons: int = 6
+    role_distribution: dict[str, int] = {
+        "ouderling": 3,
+        "kerkrentmeester": 1,
+        "diaken": 2
+    }
+    # Cost of being scheduled on a service marked with "~" (erg voorkeur niet),
+    # relative to a denied morning or evening preference
+    dislike_cost: int = 2
+    params: dict[str, float] = {
+        "n_persons": 1,
+        "role_distribution": 1,
+        "preferences": 1,
+        "n_times_present": 1,
+    }
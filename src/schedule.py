@@ -5,30 +5,16 @@ Created on Sat Apr 19 14:03:39 2025
 @author: Levi
 """
 from datetime import datetime
-from pydantic import BaseModel
+import threading
 import numpy as np
 
-from date_utils import services_to_list, get_church_dates, get_services
+from date_utils import services_to_list, get_church_dates, get_services, get_week_groups
 from create_xlsx import kerkenraad, Persons, create_excel
 from extract_from_xlsx import open_worksheet, extract_availability, extract_services
-
-
-class Rules(BaseModel):
-    """
-    This class represents the rules by which the schedule must abide.
-    """
-    n_persons: int = 6
-    role_distribution: dict[str, int] = {
-        "ouderling": 3,
-        "kerkrentmeester": 1,
-        "diaken": 2
-    }
-    params: dict[str, float] = {
-        "n_persons": 1,
-        "role_distribution": 1,
-        "preferences": 1,
-        "n_times_present": 1,
-    }
+from rules import Rules
+from solve_control import SolveControl
+from solver import CONTROLLED_METHODS, optimize_schedule, repair_schedule
+from value_utils import ScoringContext, get_scoring_context
 
 
 class Schedule:
@@ -36,15 +22,15 @@ class Schedule:
     This class represents a schedule.
     """
     def __init__(self, persons: Persons, start_date: datetime, end_date: datetime,
-                 rules=Rules, file_path: str = None):
+                 rules: Rules = None, file_path: str = None):
 
         self.persons = persons
         #TODO: check that persons from excel and provided persons don't clash
-        self.rules = rules
+        self.rules = rules if rules is not None else Rules()
 
         if file_path is not None:
             self.file_path = file_path
-            self.initialize_from_file(file_path)
+            self.initialize_from_file(file_path, start_date)
 
         else:
             self.file_path = "test_kerkenraadsrooster.xlsx"
@@ -54,15 +40,17 @@ class Schedule:
             self.duties = self.create_array()
             self.score = None
 
-    def initialize_from_file(self, file_path):
+    def initialize_from_file(self, file_path, start_date: datetime = None):
         """
         Initializes this class from the given excel file.
 
         Args:
             file_path (str): The file path of the excel file.
+            start_date (datetime, optional): The start date of the schedule,
+                used to determine the year of the dates in the file.
         """
         ws = open_worksheet(file_path)
-        self.services = extract_services(ws)
+        self.services = extract_services(ws, start_date)
         self.availability = extract_availability(ws)
         self.duties = self.create_array()
         self.score = self.schedule_score()
@@ -78,11 +66,134 @@ class Schedule:
 
         return np.zeros((n_persons, n_services), dtype=int)
 
+    def scoring_context(self) -> ScoringContext:
+        """
+        Returns the (cached) scoring context of this schedule.
+        """
+        return get_scoring_context(self.persons, self.services, self.rules,
+                                   self.availability)
+
     def schedule_score(self) -> float:
         """
-        Calculates how good a schedule is.
+        Calculates how good a schedule is. Lower is better. This is the score
+        of the solvers divided by the number of persons, so the fairness term
+        is the sum of squared differences with the mean presence.
+        """
+        context = self.scoring_context()
+        return context.score(self.duties) / context.n_persons
+
+    def optimize(self, method: str = "local_search", seed: int = None,
+                 verbose: bool = False, **kwargs):
+        """
+        Fills the duties by optimizing them, starting from the current duties,
+        or from the greedy schedule if no one is scheduled yet.
+
+        Args:
+            method (str, optional): One of solver.METHODS. Defaults to
+                "local_search".
+            seed (int, optional): Seed of the random number generator.
+            verbose (bool, optional): Whether to print progress.
+            **kwargs: Options of the method, e.g. time_limit for simulated
+                annealing and tabu search. The genetic method recombines
+                whole weeks unless other groups are given.
+        """
+        if method == "genetic":
+            kwargs.setdefault("groups", get_week_groups(self.services))
+
+        duties = self.duties if self.duties.any() else None
+        self.duties = optimize_schedule(self.scoring_context(), self.availability,
+                                        duties, method=method, seed=seed,
+                                        verbose=verbose, **kwargs)
+        self.score = self.schedule_score()
+
+    def solve(self, deadline: float = None, cancel_event: threading.Event = None,
+              method: str = "simulated_annealing", seed: int = None,
+              **kwargs) -> SolveControl:
         """
-        return 0
+        Starts optimizing the duties on a worker thread, like optimize, and
+        returns at once. The returned control cancels the run or moves its
+        deadline from any thread, and holds the best schedule so far, so a
+        user interface stays responsive while it waits.
+
+        When the run is done, the duties and score of the schedule are those
+        of the best schedule, and the control holds the error if the run
+        failed. The scores of the control are those of the solvers, i.e. the
+        number of persons times the score of the schedule.
+
+        Args:
+            deadline (float, optional): The number of seconds from now after
+                which the run stops. Defaults to None, the time limit of the
+                method.
+            cancel_event (threading.Event, optional): The event that cancels
+                the run when set. Defaults to a new event of the control.
+            method (str, optional): One of solver.CONTROLLED_METHODS, which
+                check the control. Defaults to "simulated_annealing".
+            seed (int, optional): Seed of the random number generator.
+            **kwargs: Options of the method.
+
+        Returns:
+            SolveControl: The control of the run.
+        """
+        if method not in CONTROLLED_METHODS:
+            raise ValueError(f"Method '{method}' can't be controlled, expected one of "
+                             f"{CONTROLLED_METHODS}.")
+
+        control = SolveControl(deadline, cancel_event)
+        thread = threading.Thread(target=self._solve, args=(control, method, seed, kwargs),
+                                  daemon=True)
+        thread.start()
+        return control
+
+    def _solve(self, control: SolveControl, method: str, seed: int, kwargs: dict):
+        """
+        Runs optimize with the control on the worker thread of solve.
+        """
+        try:
+            self.optimize(method, seed, control=control, **kwargs)
+        except Exception as error:
+            control.finish(error)
+        else:
+            control.finish()
+
+    def repair(self, changes: dict, window: int = 2, change_cost: float = 1,
+               seed: int = None, verbose: bool = False) -> list[tuple[str, int]]:
+        """
+        Applies changes to the availability, e.g. late cancellations, and
+        re-optimizes only the changed services and their neighbours, starting
+        from the current duties. All other services keep their duties. The
+        place of a cancelled person is filled without change cost.
+
+        Args:
+            changes (dict): The new availability per (person, service) cell,
+                with the person given by name or by index and the service by
+                index. E.g. {("C. Huisman", 3): -1}.
+            window (int, optional): The number of neighbouring services on each
+                side that may change too. Defaults to 2.
+            change_cost (float, optional): The cost of changing a duty, in the
+                units of a denied preference. Defaults to 1.
+            seed (int, optional): Seed of the random number generator.
+            verbose (bool, optional): Whether to print progress.
+
+        Returns:
+            list[tuple[str, int]]: The name of the person and the service of
+                every duty that changed.
+        """
+        names = list(self.persons)
+        for (person, service), value in changes.items():
+            if isinstance(person, str):
+                person = names.index(person)
+            self.availability[person, service] = value
+
+        services = sorted({service for _, service in changes})
+        duties = repair_schedule(self.scoring_context(), self.availability, self.duties,
+                                 services, window, change_cost, seed=seed,
+                                 verbose=verbose)
+
+        changed = [(names[person], service)
+                   for person, service in np.argwhere(duties != self.duties).tolist()]
+        self.duties = duties
+        self.score = self.schedule_score()
+        return changed
 
     def __str__(self):
         return str(self.availability)
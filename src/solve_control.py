@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Control of a solver that runs on another thread.
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+
+
+class SolveControl:
+    """
+    Controls a solver that runs on another thread, e.g. a worker thread of a
+    user interface. Any thread can cancel the run or move its deadline, and
+    read the best schedule found so far.
+
+    At the points where it already checks its budget, the solver checks
+    `cancelled`, takes its time limit from the deadline with
+    `get_time_limit`, and publishes its best schedule. A cancelled run thus
+    stops within one check interval, and the best schedule is at most that
+    old. `should_stop` tells whether the run should stop at all, e.g. before
+    polishing.
+
+    Args:
+        deadline (float, optional): The number of seconds from now after
+            which the solver stops. Defaults to None, no deadline.
+        cancel_event (threading.Event, optional): The event that cancels the
+            run when set. Defaults to a new event.
+    """
+    def __init__(self, deadline: float = None, cancel_event: threading.Event = None):
+        self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self.deadline = None
+        if deadline is not None:
+            self.set_deadline(deadline)
+        self.error = None
+
+        self._lock = threading.Lock()
+        self._best_duties = None
+        self._best_score = math.inf
+        self._done = threading.Event()
+
+    def set_deadline(self, deadline: float):
+        """
+        Sets the deadline to the given number of seconds from now, e.g. to
+        shorten it while the solver runs.
+        """
+        # perf_counter is the clock of the solvers
+        self.deadline = time.perf_counter() + deadline
+
+    def cancel(self):
+        """
+        Cancels the run. The solver stops at its next check.
+        """
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def get_time_limit(self, t_start: float, time_limit: float = None) -> float:
+        """
+        Returns the time limit of a solver that started at t_start, i.e. the
+        seconds from t_start to the deadline, or the given time limit if
+        there is no deadline.
+        """
+        deadline = self.deadline
+        if deadline is None:
+            return time_limit
+        return deadline - t_start
+
+    def should_stop(self) -> bool:
+        """
+        Returns whether the run is cancelled or past its deadline.
+        """
+        deadline = self.deadline
+        return self.cancelled or (deadline is not None and time.perf_counter() >= deadline)
+
+    @property
+    def best_score(self) -> float:
+        return self._best_score
+
+    def publish(self, duties: np.ndarray | list, score: float) -> bool:
+        """
+        Stores a copy of the duties if they are better than the best so far.
+
+        Args:
+            duties (np.ndarray | list): The duties.
+            score (float): Their score.
+
+        Returns:
+            bool: Whether the duties were stored.
+        """
+        if score >= self._best_score:
+            return False
+        duties = np.array(duties)
+        with self._lock:
+            if score >= self._best_score:
+                return False
+            self._best_duties = duties
+            self._best_score = score
+        return True
+
+    def get_best(self) -> tuple[np.ndarray, float]:
+        """
+        Returns a copy of the best duties so far and their score, or None and
+        inf if nothing has been published yet.
+        """
+        with self._lock:
+            if self._best_duties is None:
+                return None, self._best_score
+            return self._best_duties.copy(), self._best_score
+
+    def finish(self, error: Exception = None):
+        """
+        Marks the run as done, with the error that ended it, if any.
+        """
+        self.error = error
+        self._done.set()
+
+    def done(self) -> bool:
+        """
+        Returns whether the run is done.
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Waits until the run is done, or until the timeout in seconds passed.
+
+        Returns:
+            bool: Whether the run is done.
+        """
+        return self._done.wait(timeout)
+
+
+if __name__ == "__main__":
+    control = SolveControl(deadline=0.05)
+    control.publish([[1, 0], [0, 1]], 12.0)
+    while not control.should_stop():
+        time.sleep(0.01)
+    print(control.get_best(), control.cancelled)
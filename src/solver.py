@@ -0,0 +1,1731 @@
+# -*- coding: utf-8 -*-
+"""
+Solvers that optimize the duties of a schedule.
+"""
+
+import bisect
+import functools
+import itertools
+import math
+import os
+import time
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+
+from checkpoint import Checkpoint, load_checkpoint, save_checkpoint
+from create_xlsx import kerkenraad, services_dict
+from rules import Rules
+from solve_control import SolveControl
+from team_patterns import TeamTable, get_role_groups, get_team_table
+from telemetry import SolverTrace
+from value_utils import (ScoringContext, IncrementalScorer, get_score, get_score_batch,
+                         get_score_breakdown, get_scoring_context, get_weights)
+
+# The types of moves, i.e. which cells are flipped together
+MOVE_TYPES = ("single", "line_pair", "rectangle")
+
+# The optimization methods of optimize_schedule
+METHODS = ("local_search", "simulated_annealing", "tabu_search", "team_search",
+           "lagrangian", "genetic")
+
+# The methods that take a SolveControl
+CONTROLLED_METHODS = ("simulated_annealing", "tabu_search")
+
+# The cooling schedules of simulated annealing
+COOLING_SCHEDULES = ("geometric", "linear")
+
+
+class SolverResult(BaseModel):
+    """
+    This class represents the outcome of an optimization run.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    duties: np.ndarray
+    score: float
+    n_evaluations: int
+    duration: float
+
+
+################################################
+# ------------- Fixed and free cells --------- #
+################################################
+
+def get_fixed_mask(availability: np.ndarray) -> np.ndarray:
+    """
+    Returns which cells of the schedule are fixed by the availability: cells
+    of persons who are unavailable ("x" or "b") and of persons who are
+    present ("ü").
+
+    Args:
+        availability (np.ndarray): The availability, with -1 for unavailable,
+            0 for available, 1 for present and 2 for "~".
+
+    Returns:
+        np.ndarray: Boolean matrix that is True for fixed cells.
+    """
+    return (availability == -1) | (availability == 1)
+
+def get_initial_duties(availability: np.ndarray) -> np.ndarray:
+    """
+    Returns the duties in which only the persons who are present ("ü") are
+    scheduled.
+
+    Args:
+        availability (np.ndarray): The availability.
+
+    Returns:
+        np.ndarray: Matrix of zeros and ones.
+    """
+    return (availability == 1).astype(int)
+
+def apply_fixed(duties: np.ndarray, availability: np.ndarray) -> np.ndarray:
+    """
+    Returns a copy of the duties in which the fixed cells are set according
+    to the availability.
+
+    Args:
+        duties (np.ndarray): Matrix of zeros and ones.
+        availability (np.ndarray): The availability.
+
+    Returns:
+        np.ndarray: Matrix of zeros and ones.
+    """
+    duties = np.array(duties, dtype=int)
+    duties[availability == -1] = 0
+    duties[availability == 1] = 1
+    return duties
+
+
+################################################
+# ----------------- Tracing ------------------ #
+################################################
+
+def trace_progress(trace: SolverTrace, method: str, scorer: IncrementalScorer,
+                   best_duties: np.ndarray, iteration: int, t_start: float,
+                   best_score: float, n_evaluations: int, n_accepted: int,
+                   score: float = None):
+    """
+    Records the progress of a solver to the trace, with the terms of the best
+    duties, or of the working schedule if best_duties is None. The score
+    defaults to the score of the working schedule.
+    """
+    terms = None
+    if trace.terms:
+        if best_duties is None:
+            best_duties = scorer.availability
+        terms = get_score_breakdown(scorer.person_stats_counter, scorer.ideal_person_stats,
+                                    scorer.service_stats_counter, scorer.ideal_service_stats,
+                                    scorer.rules, best_duties,
+                                    scorer.cost_matrix).weighted_terms
+
+    if score is None:
+        score = scorer.score
+    trace.record(method, iteration, time.perf_counter() - t_start, score, best_score,
+                 n_evaluations, n_accepted, terms)
+
+
+################################################
+# --------------- Checkpoints ---------------- #
+################################################
+
+def get_resume_checkpoint(checkpoint_path: str, resume: bool, method: str) -> Checkpoint:
+    """
+    Returns the checkpoint to resume from, or None to start a new run.
+
+    Args:
+        checkpoint_path (str): The file path of the checkpoint.
+        resume (bool): Whether to resume from the checkpoint if it exists.
+        method (str): The method that is resumed.
+
+    Returns:
+        Checkpoint: The checkpoint, or None.
+    """
+    if not resume or checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return None
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint.method != method:
+        raise ValueError(f"The checkpoint is of '{checkpoint.method}', not of '{method}'.")
+    return checkpoint
+
+def restore_checkpoint(scorer: IncrementalScorer, rng: np.random.Generator,
+                       checkpoint: Checkpoint):
+    """
+    Sets the working schedule of the scorer and the state of the random
+    number generator to those of the checkpoint. The score is restored as
+    saved, as it is accumulated over flips rather than recomputed, so the
+    resumed run takes the same decisions as the original run.
+    """
+    set_duties(scorer, checkpoint.duties)
+    scorer.score = checkpoint.score
+    rng.bit_generator.state = checkpoint.rng_state
+
+
+################################################
+# ---------- Greedy initial schedule --------- #
+################################################
+
+def get_greedy_duties(context: ScoringContext, availability: np.ndarray) -> np.ndarray:
+    """
+    Returns a schedule built one service after the other, as a warm start
+    for the solvers. At each service, the persons who are present ("ü") are
+    scheduled first. Then each role is filled up to its desired number with
+    the free persons of that role who have the lowest key, and persons are
+    added as long as that lowers the score of the service. The key of a
+    person combines:
+        - the fairness deficit: how often the person was present so far,
+          compared with their share of the services they were available for,
+        - the preference cost of the service, including "om de week".
+    Filling the roles takes O(persons * log(persons)) time per service, and
+    every added person O(persons) time, so the schedule takes
+    O(services * persons^2) time in the worst case. Usually few persons are
+    added after the roles are filled.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+
+    Returns:
+        np.ndarray: Matrix of zeros and ones.
+    """
+    availability = np.asarray(availability)
+    n_persons, n_services = availability.shape
+    weights = get_weights(context.rules, n_persons)
+
+    counter = context.person_stats_counter
+    ideal = context.ideal_person_stats
+    row_weights = np.array([weights["n_persons"]]
+                           + [weights["role_distribution"]] * (len(counter) - 1))
+    present_counts, _, _, even_counts, odd_counts = context.service_stats_counter.T
+    is_week_person = context.ideal_service_stats[2] == 1
+
+    duties = get_initial_duties(availability)
+    free = ~get_fixed_mask(availability)
+    presence = np.zeros(n_persons)
+    expected = np.zeros(n_persons)
+    even = np.zeros(n_persons)
+    odd = np.zeros(n_persons)
+
+    for s in range(n_services):
+        # Every available person is expected to take an equal share of the
+        # desired number of persons
+        available = availability[:, s] != -1
+        expected += available * ideal[0, s] * present_counts[s] / max(available.sum(), 1)
+
+        # Cost of adding each person besides the roles
+        week_cost = (np.minimum(even + even_counts[s], odd + odd_counts[s])
+                     - np.minimum(even, odd)) * is_week_person
+        fairness_cost = (2 * (presence - expected) + present_counts[s]) * present_counts[s]
+        keys = (weights["n_times_present"] * fairness_cost * (n_persons - 1)
+                + weights["preferences"] * (context.cost_matrix[:, s] + week_cost))
+
+        # Fill each role up to its desired number, lowest keys first
+        team = duties[:, s]
+        for k in range(1, len(counter)):
+            need = ideal[k, s] - counter[k] @ team
+            candidates = np.flatnonzero(free[:, s] & (counter[k] != 0) & (team == 0))
+            if need > 0 and len(candidates):
+                chosen = candidates[np.argsort(keys[candidates], kind="stable")[:need]]
+                team[chosen] = 1
+
+        # Add persons as long as that lowers the score
+        while True:
+            candidates = np.flatnonzero(free[:, s] & (team == 0))
+            if not len(candidates):
+                break
+
+            diff = counter @ team - ideal[:, s]
+            added = counter[:, candidates]
+            deltas = (((2 * diff[:, None] + added) * added).T @ row_weights
+                      + keys[candidates])
+            best = int(np.argmin(deltas))
+            if deltas[best] >= 0:
+                break
+            team[candidates[best]] = 1
+
+        presence += team * present_counts[s]
+        even += team * even_counts[s]
+        odd += team * odd_counts[s]
+
+    return duties
+
+
+################################################
+# ----------------- Moves -------------------- #
+################################################
+
+class Neighbourhood:
+    """
+    This class represents all moves of the given types that only flip free
+    cells. A move is a tuple of (person, service) cells that are flipped
+    together. Moves are generated lazily or sampled, never stored.
+
+    The move types are: "single" flips one cell, "line_pair" flips two cells
+    in the same row or column and "rectangle" flips the four corners of a
+    rectangle.
+    """
+    def __init__(self, fixed: np.ndarray, move_types=MOVE_TYPES):
+        self.fixed = np.asarray(fixed, dtype=bool)
+        self.move_types = tuple(move_types)
+        free = ~self.fixed
+        n_persons, n_services = free.shape
+
+        # Free cells, and the free cells per row and per column
+        self._free_cells = [tuple(cell) for cell in np.argwhere(free).tolist()]
+        self._lines = ([np.flatnonzero(free[i]).tolist() for i in range(n_persons)]
+                       + [np.flatnonzero(free[:, j]).tolist() for j in range(n_services)])
+
+        # Cumulative number of pairs per row and per column
+        line_pairs = [len(cells) * (len(cells) - 1) // 2 for cells in self._lines]
+        self._line_pairs = list(itertools.accumulate(line_pairs))
+
+        # Cumulative number of rectangles per pair of rows, from the number of
+        # services at which both rows are free
+        common = free.astype(int) @ free.T.astype(int)
+        self._row_pairs = list(itertools.combinations(range(n_persons), 2))
+        rectangles = [common[i1, i2] * (common[i1, i2] - 1) // 2
+                      for i1, i2 in self._row_pairs]
+        self._rectangles = [int(n) for n in itertools.accumulate(rectangles)]
+
+        # Services at which both rows of a pair are free, filled when needed
+        self._both_free = {}
+
+        counts = {
+            "single": len(self._free_cells),
+            "line_pair": self._line_pairs[-1] if self._line_pairs else 0,
+            "rectangle": self._rectangles[-1] if self._rectangles else 0,
+        }
+        self.counts = {move_type: counts[move_type] for move_type in self.move_types}
+
+    @property
+    def size(self) -> int:
+        """
+        The total number of moves.
+        """
+        return sum(self.counts.values())
+
+    def is_free(self, person: int, service: int) -> bool:
+        """
+        Returns whether the given cell may be flipped.
+        """
+        return not self.fixed[person, service]
+
+    def iter_moves(self):
+        """
+        Generates all moves, one type after the other.
+        """
+        if "single" in self.move_types:
+            for cell in self._free_cells:
+                yield (cell,)
+
+        if "line_pair" in self.move_types:
+            for line, cells in enumerate(self._lines):
+                for k1, k2 in itertools.combinations(cells, 2):
+                    yield self._line_move(line, k1, k2)
+
+        if "rectangle" in self.move_types:
+            for pair in self._row_pairs:
+                for j1, j2 in itertools.combinations(self._get_both_free(pair), 2):
+                    yield ((pair[0], j1), (pair[0], j2), (pair[1], j1), (pair[1], j2))
+
+    def sample(self, rng: np.random.Generator, move_type: str = None) -> tuple:
+        """
+        Returns a random move. Without a move type, every move is equally
+        likely. With a move type, every move of that type is equally likely.
+
+        Args:
+            rng (np.random.Generator): The random number generator.
+            move_type (str, optional): The type of the move.
+
+        Returns:
+            tuple: The move.
+        """
+        if move_type is None:
+            index = int(rng.integers(self.size))
+            for move_type, count in self.counts.items():
+                if index < count:
+                    break
+                index -= count
+
+        return self._make_move(move_type, *rng.random(3).tolist())
+
+    def iter_samples(self, rng: np.random.Generator, n_samples: int,
+                     stratified: bool = False, block_size: int = 4096):
+        """
+        Generates random moves. The random numbers are drawn in blocks.
+
+        Args:
+            rng (np.random.Generator): The random number generator.
+            n_samples (int): The number of moves.
+            stratified (bool, optional): Whether every move type that has
+                moves is equally likely, instead of every move. Defaults to
+                False.
+            block_size (int, optional): The number of moves per block of
+                random numbers. Defaults to 4096.
+        """
+        move_types = [move_type for move_type, count in self.counts.items() if count]
+        if not move_types:
+            return
+        cumulative_counts = np.cumsum([self.counts[move_type] for move_type in move_types])
+
+        while n_samples > 0:
+            n = min(block_size, n_samples)
+            n_samples -= n
+
+            if stratified:
+                type_indices = rng.integers(len(move_types), size=n)
+            else:
+                type_indices = np.searchsorted(cumulative_counts,
+                                               rng.integers(self.size, size=n),
+                                               side="right")
+            uniforms = rng.random((n, 3)).tolist()
+
+            for type_index, (u1, u2, u3) in zip(type_indices.tolist(), uniforms):
+                yield self._make_move(move_types[type_index], u1, u2, u3)
+
+    def _make_move(self, move_type: str, u1: float, u2: float, u3: float) -> tuple:
+        # Turns three uniform random numbers into a uniformly random move of
+        # the given type
+        if move_type == "single":
+            return (self._free_cells[int(u1 * len(self._free_cells))],)
+
+        if move_type == "line_pair":
+            # Pick a line with a probability proportional to its number of pairs
+            line = bisect.bisect_right(self._line_pairs, int(u1 * self._line_pairs[-1]))
+            k1, k2 = get_pair(self._lines[line], u2, u3)
+            return self._line_move(line, k1, k2)
+
+        if move_type == "rectangle":
+            # Pick a pair of rows with a probability proportional to its
+            # number of rectangles
+            index = bisect.bisect_right(self._rectangles, int(u1 * self._rectangles[-1]))
+            i1, i2 = self._row_pairs[index]
+            j1, j2 = get_pair(self._get_both_free(self._row_pairs[index]), u2, u3)
+            return ((i1, j1), (i1, j2), (i2, j1), (i2, j2))
+
+        raise ValueError(f"Unknown move type '{move_type}'.")
+
+    def _line_move(self, line: int, k1: int, k2: int) -> tuple:
+        # Lines are the rows followed by the columns
+        n_persons = self.fixed.shape[0]
+        if line < n_persons:
+            return ((line, k1), (line, k2))
+        return ((k1, line - n_persons), (k2, line - n_persons))
+
+    def _get_both_free(self, pair: tuple[int, int]) -> list[int]:
+        if pair not in self._both_free:
+            both_free = ~self.fixed[pair[0]] & ~self.fixed[pair[1]]
+            self._both_free[pair] = np.flatnonzero(both_free).tolist()
+        return self._both_free[pair]
+
+def get_pair(items: list, u1: float, u2: float) -> tuple:
+    """
+    Returns two distinct items of a list, chosen with two uniform random
+    numbers.
+    """
+    k1 = int(u1 * len(items))
+    k2 = int(u2 * (len(items) - 1))
+    if k2 >= k1:
+        k2 += 1
+    return items[k1], items[k2]
+
+
+################################################
+# --------------- Local search --------------- #
+################################################
+
+def try_move(scorer: IncrementalScorer, move: tuple) -> float:
+    """
+    Applies a move to the scorer and returns the change in score. The move
+    can be undone with scorer.rollback() or kept with scorer.commit().
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        move (tuple): The cells to flip.
+
+    Returns:
+        float: The change in score.
+    """
+    delta = 0
+    for person, service in move:
+        delta += scorer.flip(person, service)
+    return delta
+
+def get_move_delta(scorer: IncrementalScorer, move: tuple) -> float:
+    """
+    Returns the change in score of a move, without changing the schedule.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        move (tuple): The cells to flip.
+
+    Returns:
+        float: The change in score.
+    """
+    if len(move) == 1:
+        return scorer.flip_delta(*move[0])
+
+    delta = try_move(scorer, move)
+    scorer.rollback()
+    return delta
+
+def local_search(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                 rng: np.random.Generator, min_improvement: float = 1,
+                 pass_size: int = None, stratified: bool = False,
+                 trace: SolverTrace = None, verbose: bool = False) -> SolverResult:
+    """
+    Improves the working schedule of the scorer in place. Every pass tries
+    randomly sampled moves and keeps each move that improves the score.
+    Stops when a pass improves the score by less than min_improvement.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): The moves to sample from.
+        rng (np.random.Generator): The random number generator.
+        min_improvement (float, optional): Minimal improvement of a pass to
+            continue. Defaults to 1.
+        pass_size (int, optional): The number of moves per pass. Defaults to
+            the number of moves in the neighbourhood.
+        stratified (bool, optional): Whether to sample every move type
+            equally often. Defaults to False.
+        trace (SolverTrace, optional): Records the progress after every pass,
+            at most once per interval of the trace.
+        verbose (bool, optional): Whether to print the duration and score of
+            every pass. Defaults to False.
+
+    Returns:
+        SolverResult: The improved schedule and its score.
+    """
+    if pass_size is None:
+        pass_size = neighbourhood.size
+
+    t_search = time.perf_counter()
+    n_evaluations = 0
+    n_accepted = 0
+    n_passes = 0
+
+    while True:
+        t_start = time.perf_counter()
+        start_score = scorer.score
+        n_evaluations += pass_size
+
+        for move in neighbourhood.iter_samples(rng, pass_size, stratified):
+            # Single flips don't need to be applied to be evaluated
+            if len(move) == 1:
+                if scorer.flip_delta(*move[0]) < 0:
+                    scorer.flip(*move[0])
+                    scorer.commit()
+                    n_accepted += 1
+                continue
+
+            if try_move(scorer, move) < 0:
+                scorer.commit()
+                n_accepted += 1
+            else:
+                scorer.rollback()
+        n_passes += 1
+
+        if verbose:
+            print(f"duration pass = {time.perf_counter() - t_start}, "
+                  f"score = {scorer.score}")
+
+        done = start_score - scorer.score < min_improvement
+        if trace is not None and (done or trace.due()):
+            trace_progress(trace, "local_search", scorer, None, n_passes, t_search,
+                           scorer.score, n_evaluations, n_accepted)
+
+        if done:
+            return SolverResult(duties=scorer.availability, score=scorer.score,
+                                n_evaluations=n_evaluations,
+                                duration=time.perf_counter() - t_search)
+
+
+################################################
+# ----------- Simulated annealing ------------ #
+################################################
+
+def get_temperature(progress: float, start_temperature: float,
+                    end_temperature: float, cooling: str = "geometric") -> float:
+    """
+    Returns the temperature of a cooling schedule.
+
+    Args:
+        progress (float): The fraction of the cooling schedule that has
+            passed, between 0 and 1.
+        start_temperature (float): The temperature at the start.
+        end_temperature (float): The temperature at the end.
+        cooling (str, optional): "geometric" or "linear". Defaults to
+            "geometric".
+
+    Returns:
+        float: The temperature.
+    """
+    progress = min(max(progress, 0), 1)
+    if cooling == "geometric":
+        return start_temperature * (end_temperature / start_temperature) ** progress
+    if cooling == "linear":
+        return start_temperature + (end_temperature - start_temperature) * progress
+    raise ValueError(f"Unknown cooling schedule '{cooling}', expected one of "
+                     f"{COOLING_SCHEDULES}.")
+
+def estimate_temperature(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                         rng: np.random.Generator, acceptance: float = 0.5,
+                         n_samples: int = 1000) -> float:
+    """
+    Returns the temperature at which a move that makes the score worse by
+    the average amount is accepted with the given probability. The schedule
+    of the scorer is not changed.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): The moves to sample from.
+        rng (np.random.Generator): The random number generator.
+        acceptance (float, optional): The acceptance probability. Defaults to
+            0.5.
+        n_samples (int, optional): The number of sampled moves. Defaults to
+            1000.
+
+    Returns:
+        float: The temperature.
+    """
+    increases = []
+    for move in neighbourhood.iter_samples(rng, n_samples):
+        delta = try_move(scorer, move)
+        scorer.rollback()
+        if delta > 0:
+            increases.append(delta)
+
+    if not increases:
+        return 1.0
+    return -float(np.mean(increases)) / math.log(acceptance)
+
+def simulated_annealing(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                        rng: np.random.Generator, time_limit: float = 10,
+                        max_evaluations: int = None, start_temperature: float = None,
+                        end_temperature: float = 0.05, cooling: str = "geometric",
+                        reheat_after: int = None, stratified: bool = False,
+                        check_interval: int = 1000, trace: SolverTrace = None,
+                        checkpoint_path: str = None, checkpoint_interval: float = 60,
+                        resume: bool = False, control: SolveControl = None,
+                        verbose: bool = False) -> SolverResult:
+    """
+    Optimizes the working schedule of the scorer with simulated annealing.
+    A sampled move that changes the score by delta is accepted with
+    probability exp(-delta / temperature), so moves that make the score
+    worse are accepted less often as the temperature is lowered.
+
+    The temperature follows the cooling schedule over the time limit, or
+    over max_evaluations if that is reached earlier. When reheating, the
+    cooling schedule is restarted over the remaining budget once no better
+    schedule has been found for reheat_after evaluations.
+
+    The best schedule seen is kept, so it can be returned however the run
+    ends. It is only copied when the working schedule is about to get worse
+    than it.
+
+    The run can be saved to a checkpoint at the checks, and resumed from
+    it. With a budget in evaluations, the resumed run is the same as the
+    run without interruption; with a time limit, the temperature depends on
+    the time, so it only continues with the remaining time.
+
+    With a control, the run stops when it is cancelled, and the deadline of
+    the control replaces the time limit, so moving the deadline speeds up or
+    slows down the cooling. The best schedule is published at the checks.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): The moves to sample from.
+        rng (np.random.Generator): The random number generator.
+        time_limit (float, optional): The budget in seconds, or None for no
+            time limit. Defaults to 10.
+        max_evaluations (int, optional): The budget in evaluated moves.
+            Defaults to None, no limit.
+        start_temperature (float, optional): The temperature at the start.
+            Defaults to the temperature at which an average worsening move
+            is accepted half of the time.
+        end_temperature (float, optional): The temperature at the end.
+            Defaults to 0.05.
+        cooling (str, optional): The cooling schedule, "geometric" or
+            "linear". Defaults to "geometric".
+        reheat_after (int, optional): The number of evaluations without a
+            better schedule after which to reheat. Defaults to None, no
+            reheating.
+        stratified (bool, optional): Whether to sample every move type
+            equally often. Defaults to False.
+        check_interval (int, optional): The number of evaluations between
+            updates of the temperature and checks of the budget. Defaults to
+            1000.
+        trace (SolverTrace, optional): Records the progress at the checks,
+            at most once per interval of the trace.
+        checkpoint_path (str, optional): The file to save checkpoints to.
+            Defaults to None, no checkpoints.
+        checkpoint_interval (float, optional): The minimal number of seconds
+            between checkpoints. Defaults to 60.
+        resume (bool, optional): Whether to resume from the checkpoint, if
+            it exists. Defaults to False.
+        control (SolveControl, optional): Cancels the run or sets its
+            deadline from another thread, and receives the best schedule.
+        verbose (bool, optional): Whether to print progress. Defaults to
+            False.
+
+    Returns:
+        SolverResult: The best schedule seen and its score.
+    """
+    if time_limit is None and max_evaluations is None:
+        raise ValueError("Simulated annealing needs a time limit or max_evaluations.")
+    if cooling not in COOLING_SCHEDULES:
+        raise ValueError(f"Unknown cooling schedule '{cooling}', expected one of "
+                         f"{COOLING_SCHEDULES}.")
+
+    t_start = time.perf_counter()
+    checkpoint = get_resume_checkpoint(checkpoint_path, resume, "simulated_annealing")
+
+    if checkpoint is None:
+        if start_temperature is None:
+            start_temperature = max(estimate_temperature(scorer, neighbourhood, rng),
+                                    end_temperature)
+
+        best_duties = None
+        best_score = scorer.score
+        # Whether best_duties holds the best schedule, which is otherwise the
+        # working schedule
+        best_saved = False
+
+        n_evaluations = 0
+        n_accepted = 0
+        n_reheats = 0
+        n_checks = 0
+        last_improvement = 0
+        cycle_start = 0.0
+
+    else:
+        restore_checkpoint(scorer, rng, checkpoint)
+        t_start -= checkpoint.elapsed
+        counters = checkpoint.counters
+        start_temperature = counters["start_temperature"]
+
+        best_saved = bool(counters["best_saved"])
+        best_duties = checkpoint.best_duties if best_saved else None
+        best_score = checkpoint.best_score
+
+        n_evaluations = counters["n_evaluations"]
+        n_accepted = counters["n_accepted"]
+        n_reheats = counters["n_reheats"]
+        n_checks = counters["n_checks"]
+        last_improvement = counters["last_improvement"]
+        cycle_start = counters["cycle_start"]
+
+    t_print = time.perf_counter()
+    t_checkpoint = time.perf_counter()
+
+    while True:
+        if control is not None:
+            if control.cancelled:
+                break
+            time_limit = control.get_time_limit(t_start, time_limit)
+
+        # Fraction of the budget that has been used
+        progress = 0.0
+        if time_limit is not None:
+            progress = (time.perf_counter() - t_start) / time_limit
+        if max_evaluations is not None:
+            progress = max(progress, n_evaluations / max_evaluations)
+        if progress >= 1:
+            break
+
+        # Restart the cooling schedule over the remaining budget
+        if reheat_after is not None and n_evaluations - last_improvement >= reheat_after:
+            cycle_start = progress
+            last_improvement = n_evaluations
+            n_reheats += 1
+
+        temperature = get_temperature((progress - cycle_start) / (1 - cycle_start),
+                                      start_temperature, end_temperature, cooling)
+
+        n_moves = check_interval
+        if max_evaluations is not None:
+            n_moves = min(n_moves, max_evaluations - n_evaluations)
+
+        # A move is accepted when delta <= -temperature * log(u), which has
+        # probability exp(-delta / temperature) for u uniform in (0, 1]
+        thresholds = (-temperature * np.log1p(-rng.random(n_moves))).tolist()
+
+        for move, threshold in zip(neighbourhood.iter_samples(rng, n_moves, stratified),
+                                   thresholds):
+            n_evaluations += 1
+
+            # Single flips don't need to be applied to be evaluated
+            if len(move) == 1:
+                delta = scorer.flip_delta(*move[0])
+                if delta > threshold:
+                    continue
+                if delta > 0 and not best_saved:
+                    best_duties = scorer.availability
+                    best_saved = True
+                scorer.flip(*move[0])
+
+            else:
+                delta = try_move(scorer, move)
+                if delta > threshold:
+                    scorer.rollback()
+                    continue
+                if delta > 0 and not best_saved:
+                    scorer.rollback()
+                    best_duties = scorer.availability
+                    best_saved = True
+                    try_move(scorer, move)
+
+            scorer.commit()
+            n_accepted += 1
+
+            if scorer.score < best_score - 1e-9:
+                best_score = scorer.score
+                best_saved = False
+                last_improvement = n_evaluations
+
+        n_checks += 1
+        if control is not None and best_score < control.best_score:
+            control.publish(best_duties if best_saved else scorer.availability, best_score)
+
+        if trace is not None and trace.due():
+            trace_progress(trace, "simulated_annealing", scorer,
+                           best_duties if best_saved else None, n_checks, t_start,
+                           best_score, n_evaluations, n_accepted)
+
+        if (checkpoint_path is not None
+                and time.perf_counter() - t_checkpoint >= checkpoint_interval):
+            t_checkpoint = time.perf_counter()
+            save_checkpoint(checkpoint_path, Checkpoint(
+                method="simulated_annealing",
+                duties=scorer.availability,
+                score=scorer.score,
+                best_duties=best_duties if best_saved else scorer.availability,
+                best_score=best_score,
+                rng_state=rng.bit_generator.state,
+                counters={"start_temperature": start_temperature,
+                          "best_saved": int(best_saved),
+                          "n_evaluations": n_evaluations,
+                          "n_accepted": n_accepted,
+                          "n_reheats": n_reheats,
+                          "n_checks": n_checks,
+                          "last_improvement": last_improvement,
+                          "cycle_start": cycle_start},
+                elapsed=time.perf_counter() - t_start,
+            ))
+
+        if verbose and time.perf_counter() - t_print >= 1:
+            t_print = time.perf_counter()
+            print(f"evaluations = {n_evaluations}, temperature = {temperature:.3f}, "
+                  f"score = {scorer.score:.3f}, best = {best_score:.3f}")
+
+    if not best_saved:
+        best_duties = scorer.availability
+    if control is not None:
+        control.publish(best_duties, best_score)
+    if trace is not None:
+        trace_progress(trace, "simulated_annealing", scorer, best_duties, n_checks, t_start,
+                       best_score, n_evaluations, n_accepted)
+
+    duration = time.perf_counter() - t_start
+    if verbose:
+        print(f"duration = {duration}, evaluations = {n_evaluations}, "
+              f"accepted = {n_accepted}, reheats = {n_reheats}, best = {best_score}")
+
+    return SolverResult(duties=best_duties, score=best_score,
+                        n_evaluations=n_evaluations, duration=duration)
+
+
+################################################
+# --------------- Tabu search ---------------- #
+################################################
+
+def get_column_moves(scorer: IncrementalScorer, free: list[list[bool]],
+                     service: int) -> list[tuple]:
+    """
+    Returns the moves of tabu search at a service: flipping a free cell and
+    swapping a present and an absent person, which keeps the number of
+    persons the same.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        free (list[list[bool]]): Whether each cell may be flipped.
+        service (int): Column index of the service.
+
+    Returns:
+        list[tuple]: The moves.
+    """
+    persons = [p for p, row in enumerate(free) if row[service]]
+    moves = [((p, service),) for p in persons]
+    for p, q in itertools.combinations(persons, 2):
+        if scorer.get(p, service) != scorer.get(q, service):
+            moves.append(((p, service), (q, service)))
+    return moves
+
+def tabu_search(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                rng: np.random.Generator, tenure: int = 10, time_limit: float = 10,
+                max_iterations: int = None, max_stall: int = 100,
+                polish: bool = True, trace: SolverTrace = None, checkpoint_path: str = None,
+                checkpoint_interval: float = 60, resume: bool = False,
+                control: SolveControl = None, verbose: bool = False) -> SolverResult:
+    """
+    Optimizes the working schedule of the scorer with tabu search. Every
+    iteration applies the best move that is not tabu, also when it makes the
+    score worse. The cells of an applied move are tabu for about `tenure`
+    iterations, unless flipping them gives a better schedule than the best
+    so far (aspiration).
+
+    The moves are single flips and swaps at a service. The change in score
+    of each move is cached, and only re-evaluated when a move changed its
+    service or one of its persons (don't-look bits). Every applied flip
+    changes the total presence, on which the n_times_present change of
+    every single flip depends. The single flips are therefore cached
+    without that part, and it is added for the current total presence when
+    the moves are compared. Swaps keep the total presence.
+
+    The run can be saved to a checkpoint after the iterations, including
+    the tabu list and the cached changes, and resumed from it. Without a
+    time limit, the resumed run is the same as the run without
+    interruption.
+
+    With a control, the run stops when it is cancelled or past the deadline
+    of the control, which replaces the time limit. Every new best schedule
+    is published.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): Its fixed mask gives the cells that
+            may be flipped.
+        rng (np.random.Generator): The random number generator, used to vary
+            the tenure.
+        tenure (int, optional): The minimal number of iterations a flipped
+            cell is tabu. Defaults to 10.
+        time_limit (float, optional): The budget in seconds, or None for no
+            time limit. Defaults to 10.
+        max_iterations (int, optional): The budget in iterations. Defaults to
+            None, no limit.
+        max_stall (int, optional): The number of iterations without a better
+            schedule after which to stop. Defaults to 100.
+        polish (bool, optional): Whether to improve the best schedule with
+            local search, which also moves duties between services. Skipped
+            when the control stops the run. Defaults to True.
+        trace (SolverTrace, optional): Records the progress after the
+            iterations, at most once per interval of the trace, and of the
+            polishing.
+        checkpoint_path (str, optional): The file to save checkpoints to.
+            Defaults to None, no checkpoints.
+        checkpoint_interval (float, optional): The minimal number of seconds
+            between checkpoints. Defaults to 60.
+        resume (bool, optional): Whether to resume from the checkpoint, if
+            it exists. Defaults to False.
+        control (SolveControl, optional): Cancels the run or sets its
+            deadline from another thread, and receives the best schedule.
+        verbose (bool, optional): Whether to print progress. Defaults to
+            False.
+
+    Returns:
+        SolverResult: The best schedule seen and its score.
+    """
+    t_start = time.perf_counter()
+    n_persons, n_services = neighbourhood.fixed.shape
+    free = (~neighbourhood.fixed).tolist()
+
+    # Flipping a cell with value v at a service with presence count c changes
+    # the n_times_present term by -2 * d * c * total * weight, with d = 1 - 2v,
+    # on top of the part that is cached
+    weight = get_weights(scorer.rules, n_persons)["n_times_present"]
+    present_counts = scorer.service_stats_counter[:, 0].tolist()
+
+    checkpoint = get_resume_checkpoint(checkpoint_path, resume, "tabu_search")
+
+    if checkpoint is None:
+        tabu_until = [[0] * n_services for _ in range(n_persons)]
+        column_deltas = [{} for _ in range(n_services)]
+        changed_persons = set(range(n_persons))
+        changed_services = set(range(n_services))
+
+        best_duties = scorer.availability
+        best_score = scorer.score
+        n_evaluations = 0
+        iteration = 0
+        last_improvement = 0
+
+    else:
+        restore_checkpoint(scorer, rng, checkpoint)
+        t_start -= checkpoint.elapsed
+        arrays = checkpoint.arrays
+
+        tabu_until = arrays["tabu_until"].tolist()
+        column_deltas = [{} for _ in range(n_services)]
+        for (service, p, q), delta in zip(arrays["delta_moves"].tolist(),
+                                          arrays["delta_values"].tolist()):
+            move = ((p, service),) if q < 0 else ((p, service), (q, service))
+            column_deltas[service][move] = delta
+        changed_persons = set(arrays["changed_persons"].tolist())
+        changed_services = set(arrays["changed_services"].tolist())
+
+        best_duties = checkpoint.best_duties
+        best_score = checkpoint.best_score
+        n_evaluations = checkpoint.counters["n_evaluations"]
+        iteration = checkpoint.counters["iteration"]
+        last_improvement = checkpoint.counters["last_improvement"]
+
+    t_checkpoint = time.perf_counter()
+    if control is not None:
+        control.publish(best_duties, best_score)
+
+    while iteration - last_improvement < max_stall:
+        if max_iterations is not None and iteration >= max_iterations:
+            break
+        if control is not None:
+            if control.cancelled:
+                break
+            time_limit = control.get_time_limit(t_start, time_limit)
+        if time_limit is not None and time.perf_counter() - t_start >= time_limit:
+            break
+
+        # Re-evaluate the moves at changed services, and the moves of
+        # changed persons at the other services
+        for service, deltas in enumerate(column_deltas):
+            if service in changed_services:
+                deltas.clear()
+                moves = get_column_moves(scorer, free, service)
+            else:
+                moves = [move for move in deltas
+                         if any(p in changed_persons for p, _ in move)]
+
+            shift = 2 * weight * present_counts[service] * scorer.total_presence
+            for move in moves:
+                delta = get_move_delta(scorer, move)
+                if len(move) == 1:
+                    delta += (1 - 2 * scorer.get(*move[0])) * shift
+                deltas[move] = delta
+            n_evaluations += len(moves)
+
+        changed_persons.clear()
+        changed_services.clear()
+
+        # The best move that is not tabu, or that gives a new best schedule
+        best_move = None
+        best_delta = math.inf
+        for service, deltas in enumerate(column_deltas):
+            shift = 2 * weight * present_counts[service] * scorer.total_presence
+            for move, delta in deltas.items():
+                if len(move) == 1:
+                    delta -= (1 - 2 * scorer.get(*move[0])) * shift
+                if delta >= best_delta:
+                    continue
+                if (any(tabu_until[p][s] > iteration for p, s in move)
+                        and scorer.score + delta >= best_score - 1e-9):
+                    continue
+                best_move, best_delta = move, delta
+
+        if best_move is None:
+            break
+
+        try_move(scorer, best_move)
+        scorer.commit()
+
+        iteration += 1
+        for person, service in best_move:
+            tabu_until[person][service] = iteration + tenure + int(rng.integers(tenure + 1))
+            changed_persons.add(person)
+            changed_services.add(service)
+
+        if scorer.score < best_score - 1e-9:
+            best_duties = scorer.availability
+            best_score = scorer.score
+            last_improvement = iteration
+            if control is not None:
+                control.publish(best_duties, best_score)
+
+            if verbose:
+                print(f"iteration = {iteration}, evaluations = {n_evaluations}, "
+                      f"best = {best_score:.3f}")
+
+        if trace is not None and trace.due():
+            trace_progress(trace, "tabu_search", scorer, best_duties, iteration, t_start,
+                           best_score, n_evaluations, iteration)
+
+        if (checkpoint_path is not None
+                and time.perf_counter() - t_checkpoint >= checkpoint_interval):
+            t_checkpoint = time.perf_counter()
+
+            # The cached moves as (service, person, other person or -1), in
+            # the order they are compared
+            delta_moves = [(move[0][1], move[0][0], move[1][0] if len(move) == 2 else -1)
+                           for deltas in column_deltas for move in deltas]
+            delta_values = [delta for deltas in column_deltas for delta in deltas.values()]
+            save_checkpoint(checkpoint_path, Checkpoint(
+                method="tabu_search",
+                duties=scorer.availability,
+                score=scorer.score,
+                best_duties=best_duties,
+                best_score=best_score,
+                rng_state=rng.bit_generator.state,
+                counters={"n_evaluations": n_evaluations,
+                          "iteration": iteration,
+                          "last_improvement": last_improvement},
+                arrays={"tabu_until": np.array(tabu_until),
+                        "delta_moves": np.array(delta_moves, dtype=int).reshape(-1, 3),
+                        "delta_values": np.array(delta_values, dtype=float),
+                        "changed_persons": np.array(sorted(changed_persons), dtype=int),
+                        "changed_services": np.array(sorted(changed_services), dtype=int)},
+                elapsed=time.perf_counter() - t_start,
+            ))
+
+    if trace is not None:
+        trace_progress(trace, "tabu_search", scorer, best_duties, iteration, t_start,
+                       best_score, n_evaluations, iteration)
+
+    if polish and not (control is not None and control.should_stop()):
+        set_duties(scorer, best_duties)
+        result = local_search(scorer, neighbourhood, rng, trace=trace, verbose=verbose)
+        n_evaluations += result.n_evaluations
+        best_duties, best_score = result.duties, result.score
+        if control is not None:
+            control.publish(best_duties, best_score)
+
+    duration = time.perf_counter() - t_start
+    if verbose:
+        print(f"duration = {duration}, iterations = {iteration}, "
+              f"evaluations = {n_evaluations}, best = {best_score}")
+
+    return SolverResult(duties=best_duties, score=best_score,
+                        n_evaluations=n_evaluations, duration=duration)
+
+
+################################################
+# --------------- Team search ---------------- #
+################################################
+
+def get_team_move(scorer: IncrementalScorer, team: list[int], service: int) -> tuple:
+    """
+    Returns the cells to flip to put the given team at a service.
+    """
+    return tuple((person, service) for person, value in enumerate(team)
+                 if scorer.get(person, service) != value)
+
+def get_scorer_team_tables(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                           max_extra_score: float = 0) -> list[TeamTable]:
+    """
+    Returns the team table of every service, with the fixed cells of the
+    neighbourhood set as in the working schedule of the scorer.
+    """
+    duties = scorer.availability
+    availability = np.where(neighbourhood.fixed, np.where(duties == 1, 1, -1), 0)
+    return [get_team_table(scorer.person_stats_counter, scorer.ideal_person_stats,
+                           scorer.cost_matrix, scorer.rules, availability, service,
+                           max_extra_score)
+            for service in range(duties.shape[1])]
+
+def team_search(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                rng: np.random.Generator, tables: list[TeamTable] = None,
+                max_extra_score: float = 2, min_improvement: float = 1,
+                polish: bool = True, trace: SolverTrace = None,
+                verbose: bool = False) -> SolverResult:
+    """
+    Improves the working schedule of the scorer by replacing whole teams.
+    Every pass visits the services in random order and puts the best team of
+    the service's team table there, if that improves the score. Stops when a
+    pass improves the score by less than min_improvement.
+
+    A team only changes one service, so moving a person from one service to
+    another, which the fairness often asks for, takes the polishing with
+    local search.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): Its fixed mask gives the cells that
+            may be flipped.
+        rng (np.random.Generator): The random number generator.
+        tables (list[TeamTable], optional): The team table of every service.
+            Defaults to the tables of teams at most max_extra_score worse than
+            the best role score.
+        max_extra_score (float, optional): How much worse than the best role
+            score the teams of the default tables may be. A little room lets
+            the roles give way to fairness. Defaults to 2.
+        min_improvement (float, optional): Minimal improvement of a pass to
+            continue. Defaults to 1.
+        polish (bool, optional): Whether to improve the schedule with local
+            search afterwards. Defaults to True.
+        trace (SolverTrace, optional): Records the progress after every pass,
+            at most once per interval of the trace.
+        verbose (bool, optional): Whether to print the score of every pass.
+            Defaults to False.
+
+    Returns:
+        SolverResult: The improved schedule and its score.
+    """
+    t_start = time.perf_counter()
+    if tables is None:
+        tables = get_scorer_team_tables(scorer, neighbourhood, max_extra_score)
+    teams = [table.teams.tolist() for table in tables]
+
+    n_evaluations = 0
+    n_accepted = 0
+    n_passes = 0
+    while True:
+        start_score = scorer.score
+
+        for service in rng.permutation(len(teams)).tolist():
+            best_move = None
+            best_delta = 0
+            for team in teams[service]:
+                move = get_team_move(scorer, team, service)
+                if not move:
+                    continue
+
+                delta = get_move_delta(scorer, move)
+                if delta < best_delta:
+                    best_move, best_delta = move, delta
+            n_evaluations += len(teams[service])
+
+            if best_move is not None:
+                try_move(scorer, best_move)
+                scorer.commit()
+                n_accepted += 1
+        n_passes += 1
+
+        if verbose:
+            print(f"evaluations = {n_evaluations}, score = {scorer.score}")
+
+        done = start_score - scorer.score < min_improvement
+        if trace is not None and (done or trace.due()):
+            trace_progress(trace, "team_search", scorer, None, n_passes, t_start,
+                           scorer.score, n_evaluations, n_accepted)
+
+        if done:
+            break
+
+    if polish:
+        result = local_search(scorer, neighbourhood, rng, trace=trace, verbose=verbose)
+        n_evaluations += result.n_evaluations
+
+    return SolverResult(duties=scorer.availability, score=scorer.score,
+                        n_evaluations=n_evaluations,
+                        duration=time.perf_counter() - t_start)
+
+
+################################################
+# --------- Lagrangian decomposition --------- #
+################################################
+
+def set_duties(scorer: IncrementalScorer, duties: np.ndarray):
+    """
+    Sets the working schedule of the scorer to the given duties, by flipping
+    the cells that differ.
+    """
+    for person, service in np.argwhere(scorer.availability != duties).tolist():
+        scorer.flip(person, service)
+    scorer.commit()
+
+def lagrangian_decomposition(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                             rng: np.random.Generator, tables: list[TeamTable] = None,
+                             max_extra_score: float = 2, n_iterations: int = 200,
+                             n_samples: int = 20, step_scale: float = 1,
+                             time_limit: float = None, polish: bool = True,
+                             trace: SolverTrace = None, verbose: bool = False) -> SolverResult:
+    """
+    Optimizes the schedule by solving every service independently. All terms
+    except n_times_present only depend on one service (the "om de week"
+    term is left out of the subproblems). The n_times_present term couples
+    the services, which is relaxed with a multiplier per person:
+
+        min over teams  sum_s cost_s + sum_p multiplier_p * presence_p
+                        - |multipliers|^2 / (4 * weight)
+
+    with multipliers that sum to zero. Each service then takes the cheapest
+    team from its team table with the multipliers as the cost of presence.
+    The multipliers follow subgradient steps, so persons who are present
+    more often than the relaxation wants become more expensive.
+
+    The cheapest teams jump between extremes as the multipliers change, so
+    a schedule is built from how often each service chose each team: every
+    service samples a team from those frequencies, independently. The best
+    sampled schedule is optionally polished with team search. The work per
+    iteration and per pass grows linearly with the number of services.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): Its fixed mask gives the cells that
+            may be flipped.
+        rng (np.random.Generator): The random number generator.
+        tables (list[TeamTable], optional): The team table of every service.
+            Defaults to the tables of teams at most max_extra_score worse than
+            the best role score.
+        max_extra_score (float, optional): How much worse than the best role
+            score the teams of the default tables may be. Defaults to 2.
+        n_iterations (int, optional): The number of subgradient steps.
+            Defaults to 200.
+        n_samples (int, optional): The number of sampled schedules. Defaults
+            to 20.
+        step_scale (float, optional): The initial scale of the Polyak step,
+            halved when the relaxation hasn't improved for 20 iterations.
+            Defaults to 1.
+        time_limit (float, optional): The budget in seconds for the
+            subgradient steps. Defaults to None, no limit.
+        polish (bool, optional): Whether to improve the best schedule with
+            team search. Defaults to True.
+        trace (SolverTrace, optional): Records the progress of the
+            subgradient steps, at most once per interval of the trace, and
+            of the polishing.
+        verbose (bool, optional): Whether to print progress.
+
+    Returns:
+        SolverResult: The best schedule found and its score.
+    """
+    t_start = time.perf_counter()
+    if tables is None:
+        tables = get_scorer_team_tables(scorer, neighbourhood, max_extra_score)
+
+    # The spread is n times the sum of squared differences with the mean
+    n_persons = len(scorer.person_stats_counter[0])
+    weight = n_persons * get_weights(scorer.rules, n_persons)["n_times_present"]
+    present_counts = scorer.service_stats_counter[:, 0]
+    multipliers = np.zeros(n_persons)
+
+    # How often each service chose each team
+    frequencies = [np.zeros(len(table)) for table in tables]
+
+    best_bound = -math.inf
+    last_improvement = 0
+    n_evaluations = 0
+
+    for iteration in range(n_iterations):
+        if time_limit is not None and time.perf_counter() - t_start >= time_limit:
+            break
+
+        # The cheapest team of every service, with presence costing the
+        # multipliers
+        bound = 0.0
+        presence = np.zeros(len(multipliers))
+        for table, count, frequency in zip(tables, present_counts, frequencies):
+            costs = table.costs + table.teams @ (multipliers * count)
+            t = int(np.argmin(costs))
+            bound += costs[t]
+            presence += table.teams[t] * count
+            frequency[t] += 1
+            n_evaluations += len(table)
+
+        # Without fairness there is nothing to coordinate
+        if weight == 0:
+            break
+
+        bound -= multipliers @ multipliers / (4 * weight)
+        if bound > best_bound + 1e-9:
+            best_bound = bound
+            last_improvement = iteration
+        elif iteration - last_improvement >= 20:
+            step_scale /= 2
+            last_improvement = iteration
+
+        # The presence the relaxation wants is the mean plus the multipliers
+        # divided by twice the weight
+        subgradient = presence - presence.mean() - multipliers / (2 * weight)
+        norm = subgradient @ subgradient
+        if norm < 1e-12:
+            break
+
+        # Polyak step, with the relaxation's own presence spread as estimate
+        # of the gap
+        target = bound + weight * np.sum((presence - presence.mean()) ** 2)
+        step = step_scale * max(target - bound, 1e-3) / norm
+        multipliers += step * subgradient
+        multipliers -= multipliers.mean()
+
+        if trace is not None and trace.due():
+            trace_progress(trace, "lagrangian", scorer, None, iteration, t_start,
+                           scorer.score, n_evaluations, 0)
+
+        if verbose:
+            print(f"iteration = {iteration}, bound = {bound:.3f}")
+
+    # Sample schedules from the frequencies of the teams
+    best_duties = scorer.availability
+    best_score = scorer.score
+    for _ in range(n_samples):
+        duties = np.stack([table.teams[rng.choice(len(table), p=frequency / frequency.sum())]
+                           for table, frequency in zip(tables, frequencies)], axis=1)
+        score = get_score(scorer.person_stats_counter, scorer.ideal_person_stats,
+                          scorer.service_stats_counter, scorer.ideal_service_stats,
+                          scorer.rules, duties, scorer.cost_matrix)
+        if score < best_score:
+            best_duties, best_score = duties, score
+
+    if verbose:
+        print(f"best sampled score = {best_score}")
+
+    set_duties(scorer, best_duties)
+    if trace is not None:
+        trace_progress(trace, "lagrangian", scorer, None, n_iterations, t_start,
+                       scorer.score, n_evaluations, 0)
+    if polish:
+        result = team_search(scorer, neighbourhood, rng, tables, polish=False,
+                             trace=trace, verbose=verbose)
+        n_evaluations += result.n_evaluations
+
+    return SolverResult(duties=scorer.availability, score=scorer.score,
+                        n_evaluations=n_evaluations,
+                        duration=time.perf_counter() - t_start)
+
+
+################################################
+# ------------- Genetic search --------------- #
+################################################
+
+def get_swap_groups(scorer: IncrementalScorer, neighbourhood: Neighbourhood
+                    ) -> list[tuple[int, np.ndarray]]:
+    """
+    Returns the free persons of every role at every service, for the roles
+    that have free persons there.
+    """
+    swap_groups = []
+    for group in get_role_groups(scorer.person_stats_counter):
+        for service in range(neighbourhood.fixed.shape[1]):
+            persons = group[~neighbourhood.fixed[group, service]]
+            if len(persons):
+                swap_groups.append((service, persons))
+    return swap_groups
+
+def mutate(population: np.ndarray, swap_groups: list[tuple[int, np.ndarray]],
+           n_swaps: int, rng: np.random.Generator, flip_rate: float = 0):
+    """
+    Mutates every schedule of the population in place with random swaps. A
+    swap replaces a scheduled person by an unscheduled person of the same
+    role at the same service, so the number of persons per role is kept.
+    With probability flip_rate, a mutation flips a single free cell instead.
+
+    Args:
+        population (np.ndarray): Array of shape (k, persons, services).
+        swap_groups (list[tuple[int, np.ndarray]]): The free persons of
+            every role at every service, see get_swap_groups.
+        n_swaps (int): The number of mutations per schedule.
+        rng (np.random.Generator): The random number generator.
+        flip_rate (float, optional): The probability that a mutation is a
+            flip. Defaults to 0.
+    """
+    if not swap_groups:
+        return
+
+    indices = rng.integers(len(swap_groups), size=(len(population), n_swaps)).tolist()
+    uniforms = rng.random((len(population), n_swaps, 3)).tolist()
+    for duties, duty_indices, duty_uniforms in zip(population, indices, uniforms):
+        for index, (u1, u2, u3) in zip(duty_indices, duty_uniforms):
+            service, persons = swap_groups[index]
+            if u3 < flip_rate:
+                person = persons[int(u1 * len(persons))]
+                duties[person, service] = 1 - duties[person, service]
+                continue
+
+            values = duties[persons, service]
+            scheduled = persons[values == 1]
+            unscheduled = persons[values == 0]
+            if len(scheduled) and len(unscheduled):
+                duties[scheduled[int(u1 * len(scheduled))], service] = 0
+                duties[unscheduled[int(u2 * len(unscheduled))], service] = 1
+
+def genetic_search(scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+                   rng: np.random.Generator, groups: list[list[int]] = None,
+                   population_size: int = 32, n_generations: int = 2000,
+                   n_elite: int = 2, tournament_size: int = 3, n_swaps: int = 1,
+                   flip_rate: float = 0.2, max_stall: int = 200,
+                   time_limit: float = None, polish: bool = True,
+                   trace: SolverTrace = None, verbose: bool = False) -> SolverResult:
+    """
+    Optimizes a population of schedules. A child takes every group of
+    service columns, e.g. the services of a week, as a whole from one of two
+    parents chosen by tournament, and is mutated with swaps that keep the
+    number of persons per role. The best schedules are kept as they are.
+    Every generation is scored in one pass over the stacked schedules.
+
+    Recombining whole teams keeps the role terms of the parents, so the
+    search is mostly about fairness and preferences. The population starts
+    from the working schedule with random swaps; the best schedule found is
+    optionally polished with local search, which can also change the
+    number of persons per role.
+
+    Args:
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): Its fixed mask gives the cells that
+            may be changed.
+        rng (np.random.Generator): The random number generator.
+        groups (list[list[int]], optional): The column indices of the groups
+            that are inherited as a whole, e.g. date_utils.get_week_groups.
+            Every column is in exactly one group. Defaults to a group per
+            service.
+        population_size (int, optional): The number of schedules. Defaults
+            to 32.
+        n_generations (int, optional): The maximum number of generations.
+            Defaults to 2000.
+        n_elite (int, optional): The number of best schedules that are kept
+            as they are. Defaults to 2.
+        tournament_size (int, optional): The number of schedules competing
+            to be a parent. Defaults to 3.
+        n_swaps (int, optional): The number of mutations per child.
+            Defaults to 1.
+        flip_rate (float, optional): The probability that a mutation flips
+            a single cell instead of swapping two persons of the same role,
+            which lets the roles give way to fairness. Defaults to 0.2.
+        max_stall (int, optional): The number of generations without
+            improvement of the best schedule after which to stop. Defaults
+            to 200.
+        time_limit (float, optional): The budget in seconds for the
+            generations. Defaults to None, no limit.
+        polish (bool, optional): Whether to improve the best schedule with
+            local search. Defaults to True.
+        trace (SolverTrace, optional): Records the progress after the
+            generations, at most once per interval of the trace, and of the
+            polishing. The score is the best score of the generation.
+        verbose (bool, optional): Whether to print progress.
+
+    Returns:
+        SolverResult: The best schedule found and its score.
+    """
+    t_start = time.perf_counter()
+    duties = scorer.availability
+    n_services = duties.shape[1]
+    n_children = population_size - n_elite
+
+    if groups is None:
+        groups = [[service] for service in range(n_services)]
+    labels = np.full(n_services, -1)
+    for label, columns in enumerate(groups):
+        labels[columns] = label
+    if (labels < 0).any():
+        raise ValueError("Every service has to be in a group.")
+
+    score_batch = functools.partial(get_score_batch, scorer.person_stats_counter,
+                                    scorer.ideal_person_stats, scorer.service_stats_counter,
+                                    scorer.ideal_service_stats, scorer.rules,
+                                    cost_matrix=scorer.cost_matrix)
+
+    # The working schedule and mutations of it, each of a different strength
+    swap_groups = get_swap_groups(scorer, neighbourhood)
+    population = np.repeat(duties[None], population_size, axis=0)
+    for k in range(1, population_size):
+        mutate(population[k:k + 1], swap_groups, k * n_services // population_size, rng,
+               flip_rate)
+    scores = score_batch(population)
+    n_evaluations = population_size
+
+    best = int(np.argmin(scores))
+    best_duties, best_score = population[best].copy(), scores[best]
+    last_improvement = 0
+    n_improvements = 0
+    generation = 0
+
+    for generation in range(n_generations):
+        if time_limit is not None and time.perf_counter() - t_start >= time_limit:
+            break
+        if generation - last_improvement >= max_stall:
+            break
+
+        # Parents by tournament
+        contestants = rng.integers(population_size, size=(2, n_children, tournament_size))
+        winners = np.take_along_axis(contestants,
+                                     np.argmin(scores[contestants], axis=-1)[..., None],
+                                     axis=-1)[..., 0]
+
+        # Every group of columns from one of the two parents
+        from_first = (rng.random((n_children, len(groups))) < 0.5)[:, labels]
+        children = np.where(from_first[:, None, :], population[winners[0]],
+                            population[winners[1]])
+        mutate(children, swap_groups, n_swaps, rng, flip_rate)
+
+        elite = np.argsort(scores)[:n_elite]
+        population = np.concatenate([population[elite], children])
+        scores = np.concatenate([scores[elite], score_batch(children)])
+        n_evaluations += n_children
+
+        best = int(np.argmin(scores))
+        if scores[best] < best_score - 1e-9:
+            best_duties, best_score = population[best].copy(), scores[best]
+            last_improvement = generation
+            n_improvements += 1
+
+        if trace is not None and trace.due():
+            trace_progress(trace, "genetic", scorer, best_duties, generation, t_start,
+                           best_score, n_evaluations, n_improvements, scores[best])
+
+        if verbose and generation % 50 == 0:
+            print(f"generation = {generation}, best score = {best_score}, "
+                  f"mean score = {scores.mean()}")
+
+    set_duties(scorer, best_duties)
+    if trace is not None:
+        trace_progress(trace, "genetic", scorer, None, generation, t_start,
+                       best_score, n_evaluations, n_improvements)
+    if polish:
+        result = local_search(scorer, neighbourhood, rng, trace=trace, verbose=verbose)
+        n_evaluations += result.n_evaluations
+
+    return SolverResult(duties=scorer.availability, score=scorer.score,
+                        n_evaluations=n_evaluations,
+                        duration=time.perf_counter() - t_start)
+
+
+################################################
+# --------------- Optimization --------------- #
+################################################
+
+def run_method(method: str, scorer: IncrementalScorer, neighbourhood: Neighbourhood,
+               rng: np.random.Generator, verbose: bool = False,
+               **kwargs) -> SolverResult:
+    """
+    Optimizes the working schedule of the scorer with the given method.
+
+    Args:
+        method (str): One of METHODS.
+        scorer (IncrementalScorer): The scorer holding the working schedule.
+        neighbourhood (Neighbourhood): The moves to use.
+        rng (np.random.Generator): The random number generator.
+        verbose (bool, optional): Whether to print progress.
+        **kwargs: Options of the method.
+
+    Returns:
+        SolverResult: The best schedule found and its score.
+    """
+    if method == "local_search":
+        return local_search(scorer, neighbourhood, rng, verbose=verbose, **kwargs)
+    if method == "simulated_annealing":
+        return simulated_annealing(scorer, neighbourhood, rng, verbose=verbose, **kwargs)
+    if method == "tabu_search":
+        return tabu_search(scorer, neighbourhood, rng, verbose=verbose, **kwargs)
+    if method == "team_search":
+        return team_search(scorer, neighbourhood, rng, verbose=verbose, **kwargs)
+    if method == "lagrangian":
+        return lagrangian_decomposition(scorer, neighbourhood, rng, verbose=verbose, **kwargs)
+    if method == "genetic":
+        return genetic_search(scorer, neighbourhood, rng, verbose=verbose, **kwargs)
+
+    raise ValueError(f"Unknown method '{method}', expected one of {METHODS}.")
+
+def optimize_schedule(context: ScoringContext, availability: np.ndarray,
+                      duties: np.ndarray = None, method: str = "local_search",
+                      move_types=MOVE_TYPES, seed: int = None,
+                      verbose: bool = False, **kwargs) -> np.ndarray:
+    """
+    Returns optimized duties for the given availability, optimizing a single
+    working matrix with the given method.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+        duties (np.ndarray, optional): The duties to start from. Defaults to
+            the greedy schedule.
+        method (str, optional): One of METHODS. Defaults to "local_search".
+        move_types (tuple[str], optional): The types of moves to use.
+        seed (int, optional): Seed of the random number generator.
+        verbose (bool, optional): Whether to print progress.
+        **kwargs: Options of the method, e.g. time_limit for simulated
+            annealing and tabu search.
+
+    Returns:
+        np.ndarray: The optimized duties, a matrix of zeros and ones.
+    """
+    rng = np.random.default_rng(seed)
+
+    if duties is None:
+        duties = get_greedy_duties(context, availability)
+    duties = apply_fixed(duties, availability)
+
+    scorer = context.incremental_scorer(duties)
+    neighbourhood = Neighbourhood(get_fixed_mask(availability), move_types)
+
+    return run_method(method, scorer, neighbourhood, rng, verbose, **kwargs).duties
+
+def repair_schedule(context: ScoringContext, availability: np.ndarray,
+                    duties: np.ndarray, services: list[int], window: int = 2,
+                    change_cost: float = 1, method: str = "local_search",
+                    move_types=MOVE_TYPES, seed: int = None, verbose: bool = False,
+                    **kwargs) -> np.ndarray:
+    """
+    Re-optimizes the given services of a schedule after their availability
+    changed, together with the services up to `window` columns before and
+    after them. All other services keep their duties. Every changed duty
+    costs change_cost, so the repair changes as few duties as needed, except
+    a new duty in one of the changed services. Filling the place of a
+    cancelled person is free, so the place is filled whenever the score
+    prefers a full service, e.g. unless every available person has the
+    wrong role or a denied preference.
+
+    Args:
+        context (ScoringContext): The scoring context of the new availability.
+        availability (np.ndarray): The new availability.
+        duties (np.ndarray): The current duties.
+        services (list[int]): Column indices of the changed services.
+        window (int, optional): The number of neighbouring services on each
+            side that may change too. Defaults to 2.
+        change_cost (float, optional): The cost of changing a duty, in the
+            units of a denied preference. Defaults to 1.
+        method (str, optional): One of METHODS. Defaults to "local_search".
+        move_types (tuple[str], optional): The types of moves to use.
+        seed (int, optional): Seed of the random number generator.
+        verbose (bool, optional): Whether to print progress.
+        **kwargs: Options of the method.
+
+    Returns:
+        np.ndarray: The repaired duties, a matrix of zeros and ones.
+    """
+    rng = np.random.default_rng(seed)
+    current = apply_fixed(duties, availability)
+    n_services = current.shape[1]
+
+    # Only the changed services and their neighbours may change
+    columns = np.zeros(n_services, dtype=bool)
+    for service in services:
+        columns[max(service - window, 0):service + window + 1] = True
+    fixed = get_fixed_mask(availability) | ~columns[None, :]
+
+    # Changing a duty costs change_cost, which is linear in the schedule, but
+    # adding a duty to a changed service is free
+    change_costs = change_cost * (1 - 2 * np.asarray(duties))
+    change_costs[:, services] = np.minimum(change_costs[:, services], 0)
+    cost_matrix = context.cost_matrix + change_costs
+    scorer = IncrementalScorer(context.person_stats_counter, context.ideal_person_stats,
+                               context.service_stats_counter, context.ideal_service_stats,
+                               context.rules, current, cost_matrix)
+    neighbourhood = Neighbourhood(fixed, move_types)
+    result = run_method(method, scorer, neighbourhood, rng, verbose, **kwargs)
+
+    # The window has few moves, so finish by trying all of them, as sampling
+    # may miss the single flip that fills a cancelled place
+    set_duties(scorer, result.duties)
+    improved = True
+    while improved:
+        improved = False
+        for move in neighbourhood.iter_moves():
+            if try_move(scorer, move) < 0:
+                scorer.commit()
+                improved = True
+            else:
+                scorer.rollback()
+
+    return scorer.availability
+
+
+if __name__ == "__main__":
+    scoring_context = get_scoring_context(kerkenraad, services_dict, Rules())
+    availability_ = np.zeros((scoring_context.n_persons, scoring_context.n_services),
+                             dtype=int)
+
+    t_start_ = time.perf_counter()
+    duties_ = optimize_schedule(scoring_context, availability_, seed=0, verbose=True)
+    print(f"duration = {time.perf_counter() - t_start_}")
+    print(scoring_context.score_breakdown(duties_).weighted_terms)
+
+    duties_ = optimize_schedule(scoring_context, availability_, duties_,
+                                method="simulated_annealing", seed=0, time_limit=10,
+                                verbose=True)
+    print(scoring_context.score_breakdown(duties_).weighted_terms)
+
+    # A late cancellation is replaced by someone else
+    person_ = int(np.flatnonzero(duties_[:, 0])[0])
+    availability_[person_, 0] = -1
+    repaired_ = repair_schedule(get_scoring_context(kerkenraad, services_dict, Rules(),
+                                                    availability_),
+                                availability_, duties_, [0], seed=0)
+    assert repaired_[person_, 0] == 0 and repaired_[:, 0].sum() == duties_[:, 0].sum()
+    print(f"changed duties = {np.argwhere(repaired_ != duties_).tolist()}")
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tables of the teams that can be scheduled at each service.
+"""
+
+import itertools
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+
+from create_xlsx import kerkenraad, services_dict
+from rules import Rules
+from value_utils import ScoringContext, get_scoring_context, get_weights
+
+
+class TeamTable(BaseModel):
+    """
+    This class represents the teams that can be scheduled at a service. Each
+    team has its role score, the n_persons and role_distribution terms, and
+    its cost, which adds the linear preferences. Teams are sorted by cost.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    service: int
+    teams: np.ndarray
+    role_scores: np.ndarray
+    costs: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.teams)
+
+
+def get_role_groups(person_stats_counter: np.ndarray) -> list[np.ndarray]:
+    """
+    Groups the persons by their column in the person stats counter, i.e. by
+    their role.
+
+    Args:
+        person_stats_counter (np.ndarray): The person stats counter.
+
+    Returns:
+        list[np.ndarray]: The person indices of each group.
+    """
+    _, labels = np.unique(person_stats_counter.T, axis=0, return_inverse=True)
+    labels = labels.ravel()
+    return [np.flatnonzero(labels == label) for label in np.unique(labels)]
+
+def get_team_table(person_stats_counter: np.ndarray, ideal_person_stats: np.ndarray,
+                   cost_matrix: np.ndarray, rules: Rules, availability: np.ndarray,
+                   service: int, max_extra_score: float = 0) -> TeamTable:
+    """
+    Lists the teams at a service with the best possible role score, given
+    who is present ("ü") and who is unavailable ("x" or "b"). If the role
+    distribution can be met, these are exactly the teams that meet it.
+
+    Rather than all subsets of the persons, only the numbers of persons per
+    role with a good enough role score are listed, and for each of them the
+    combinations of free persons per role.
+
+    Args:
+        person_stats_counter (np.ndarray): Counts the number of persons and
+            the roles.
+        ideal_person_stats (np.ndarray): The desired person stats.
+        cost_matrix (np.ndarray): The linear preference costs.
+        rules (Rules): The rules with the weights.
+        availability (np.ndarray): The availability.
+        service (int): Column index of the service.
+        max_extra_score (float, optional): How much worse than the best role
+            score a team may be, in the units of the score shown to the user,
+            i.e. the score divided by the number of persons. Defaults to 0.
+
+    Returns:
+        TeamTable: The teams at the service.
+    """
+    column = np.asarray(availability)[:, service]
+    n_persons = len(column)
+    weights = get_weights(rules, n_persons)
+    ideal = ideal_person_stats[:, service]
+
+    # Persons who are present and persons who are free, per role
+    groups = get_role_groups(person_stats_counter)
+    forced = [group[column[group] == 1] for group in groups]
+    free = [group[(column[group] != 1) & (column[group] != -1)] for group in groups]
+
+    # Role score of every number of persons per role
+    counts = np.array(list(itertools.product(*[range(len(f), len(f) + len(g) + 1)
+                                                for f, g in zip(forced, free)])))
+    group_counters = np.stack([person_stats_counter[:, group[0]] for group in groups], axis=1)
+    diff = counts @ group_counters.T - ideal
+    row_weights = np.array([weights["n_persons"]]
+                           + [weights["role_distribution"]] * (len(ideal) - 1))
+    count_scores = (diff * diff) @ row_weights
+
+    # Every team for each number of persons per role that scores well enough
+    present = (column == 1).astype(int)
+    teams = []
+    role_scores = []
+    for count, score in zip(counts, count_scores):
+        if score > count_scores.min() + max_extra_score * n_persons:
+            continue
+
+        choices = [itertools.combinations(g, c - len(f))
+                   for f, g, c in zip(forced, free, count)]
+        for chosen in itertools.product(*choices):
+            team = present.copy()
+            team[list(itertools.chain(*chosen))] = 1
+            teams.append(team)
+            role_scores.append(score)
+
+    teams = np.array(teams, dtype=int).reshape(-1, len(column))
+    role_scores = np.array(role_scores, dtype=float)
+    costs = role_scores + weights["preferences"] * (teams @ cost_matrix[:, service])
+
+    order = np.argsort(costs, kind="stable")
+    return TeamTable(service=service, teams=teams[order],
+                     role_scores=role_scores[order], costs=costs[order])
+
+def get_team_tables(context: ScoringContext, availability: np.ndarray,
+                    max_extra_score: float = 0) -> list[TeamTable]:
+    """
+    Returns the team table of every service.
+
+    Args:
+        context (ScoringContext): The scoring context of the schedule.
+        availability (np.ndarray): The availability.
+        max_extra_score (float, optional): How much worse than the best role
+            score a team may be. Defaults to 0.
+
+    Returns:
+        list[TeamTable]: The team table of every service.
+    """
+    return [get_team_table(context.person_stats_counter, context.ideal_person_stats,
+                           context.cost_matrix, context.rules, availability, service,
+                           max_extra_score)
+            for service in range(context.n_services)]
+
+
+if __name__ == "__main__":
+    scoring_context = get_scoring_context(kerkenraad, services_dict, Rules())
+    rng = np.random.default_rng(0)
+    availability_ = np.where(rng.random((scoring_context.n_persons,
+                                         scoring_context.n_services)) < 0.3, -1, 0)
+
+    tables_ = get_team_tables(scoring_context, availability_)
+    n_free = (availability_ == 0).sum(axis=0)
+    print(f"teams: {sum(len(table) for table in tables_)}, "
+          f"subsets: {int(np.sum(2.0 ** n_free))}")
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Trace records of the progress of solver runs.
+"""
+
+import math
+import time
+from typing import Callable
+
+from pydantic import BaseModel
+
+
+class TraceRecord(BaseModel):
+    """
+    This class represents the progress of a solver at one moment. The terms
+    are the weighted terms of the score of the best schedule so far.
+    """
+    method: str
+    iteration: int
+    elapsed: float
+    score: float
+    best_score: float
+    n_evaluations: int
+    n_accepted: int
+    evaluations_per_second: float
+    terms: dict[str, float] = {}
+
+
+class SolverTrace:
+    """
+    Collects the progress of solver runs as TraceRecords, which are written
+    as JSON lines to a file, passed to a callback, or both.
+
+    Solvers ask `due` whether `interval` seconds have passed since the last
+    record at points where they already check their budget, and only then
+    build a record. Without a trace the solvers skip this altogether, so
+    tracing costs nothing when it is disabled. Every solver also records its
+    final state. With `terms`, records hold the weighted terms of the best
+    schedule.
+    """
+    def __init__(self, path: str = None, callback: Callable[[TraceRecord], None] = None,
+                 interval: float = 1, terms: bool = True):
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self.terms = terms
+        self.n_records = 0
+
+        self._file = None
+        self._t_last = -math.inf
+
+    def due(self) -> bool:
+        """
+        Returns whether the interval since the last record has passed.
+        """
+        return time.perf_counter() - self._t_last >= self.interval
+
+    def record(self, method: str, iteration: int, elapsed: float, score: float,
+               best_score: float, n_evaluations: int, n_accepted: int,
+               terms: dict[str, float] = None) -> TraceRecord:
+        """
+        Makes a record and writes it to the file and the callback.
+
+        Args:
+            method (str): The name of the solver.
+            iteration (int): The iteration of the solver, e.g. the pass or
+                the generation.
+            elapsed (float): The number of seconds since the solver started.
+            score (float): The score of the working schedule.
+            best_score (float): The score of the best schedule so far.
+            n_evaluations (int): The number of evaluated moves or schedules.
+            n_accepted (int): The number of accepted moves, or of
+                improvements of the best schedule for solvers without moves.
+            terms (dict[str, float], optional): The weighted terms of the
+                best schedule.
+
+        Returns:
+            TraceRecord: The record.
+        """
+        self._t_last = time.perf_counter()
+        trace_record = TraceRecord(
+            method=method,
+            iteration=iteration,
+            elapsed=elapsed,
+            score=score,
+            best_score=best_score,
+            n_evaluations=n_evaluations,
+            n_accepted=n_accepted,
+            evaluations_per_second=n_evaluations / elapsed if elapsed > 0 else 0.0,
+            terms=terms or {},
+        )
+        self.n_records += 1
+
+        if self.path is not None:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(trace_record.model_dump_json() + "\n")
+            self._file.flush()
+        if self.callback is not None:
+            self.callback(trace_record)
+
+        return trace_record
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "SolverTrace":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    solver_trace = SolverTrace(callback=print, interval=0)
+    solver_trace.record("local_search", 1, 0.5, 60.0, 60.0, 20000, 150)
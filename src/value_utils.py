@@ -5,10 +5,17 @@ Created on Sun Apr 20 12:05:22 2025
 @author: Levi
 """
 
+import hashlib
+import json
+import time
+import tracemalloc
+from collections import OrderedDict
+
 import numpy as np
+from pydantic import BaseModel, ConfigDict
 from date_utils import services_to_list, is_special_date
 from create_xlsx import services_dict, kerkenraad
-from schedule import Rules
+from rules import Rules
 
 
 ################################################
@@ -34,7 +41,7 @@ def get_count_persons_vector(n_persons: int) -> list[int]:
     return [1 for _ in range(n_persons)]
 
 def get_morning_pref_vector(services) -> list[int]:
-    morning_vector = services
+    morning_vector = {}
     for date, day in services.items():
         if is_special_date(date):
             morning_vector[date] = [0 for _ in day]  # Ignore special dates
@@ -45,7 +52,7 @@ def get_morning_pref_vector(services) -> list[int]:
     return services_to_list(morning_vector)
 
 def get_evening_pref_vector(services) -> list[int]:
-    evening_vector = services
+    evening_vector = {}
     for date, day in services.items():
         if is_special_date(date):
             evening_vector[date] = [0 for _ in day]  # Ignore special dates
@@ -56,7 +63,7 @@ def get_evening_pref_vector(services) -> list[int]:
     return services_to_list(evening_vector)
 
 def get_even_week_vector(services) -> list[int]:
-    even_week_vector = services
+    even_week_vector = {}
     for date, day in services.items():
         week_number = int(date.strftime("%V"))
 
@@ -70,7 +77,7 @@ def get_even_week_vector(services) -> list[int]:
     return services_to_list(even_week_vector)
 
 def get_odd_week_vector(services) -> list[int]:
-    odd_week_vector = services
+    odd_week_vector = {}
     for date, day in services.items():
         week_number = int(date.strftime("%V"))
 
@@ -142,55 +149,830 @@ def get_ideal_service_stats(persons):
 
     return np.array(ideal_service_stats)
 
+def get_cost_matrix(service_stats_counter: np.ndarray, ideal_service_stats: np.ndarray,
+                    rules: Rules = None, availability: np.ndarray = None) -> np.ndarray:
+    """
+    Returns the cost of each person being present at each service, for all
+    preferences that are linear in the schedule: the morning and evening
+    preferences, and the services marked with "~" (erg voorkeur niet).
+
+    Args:
+        service_stats_counter (np.ndarray): Counts presence and denied
+            preferences per person.
+        ideal_service_stats (np.ndarray): One-hot encoding of the preferences.
+        rules (Rules, optional): The rules containing the cost of a "~" mark.
+        availability (np.ndarray, optional): The availability, in which "~"
+            is marked with 2.
+
+    Returns:
+        np.ndarray: Integer matrix with a row per person and a column per
+            service.
+    """
+    # Denied morning and evening preferences
+    cost_matrix = (np.outer(ideal_service_stats[0], service_stats_counter[:, 1])
+                   + np.outer(ideal_service_stats[1], service_stats_counter[:, 2]))
+
+    # Services the person would very much prefer not to attend
+    if availability is not None:
+        cost_matrix += rules.dislike_cost * (np.asarray(availability) == 2)
+
+    return cost_matrix
+
 
 ################################################
 # -------------- Score function -------------- #
 ################################################
 
+# The terms of the score
+TERMS = ("n_persons", "role_distribution", "n_times_present", "preferences")
+
+def get_presence_spread(presence: np.ndarray) -> np.ndarray:
+    """
+    Returns n * sum(x^2) - sum(x)^2 over the last axis, which is n times the
+    sum of squared differences with the mean number of times present. For
+    integer presence counts this is computed exactly in integer arithmetic.
+
+    Args:
+        presence (np.ndarray): How often each person is present.
+
+    Returns:
+        np.ndarray: The spread of the presence.
+    """
+    n_persons = presence.shape[-1]
+    total = presence.sum(axis=-1)
+    return n_persons * np.einsum("...p,...p->...", presence, presence) - total * total
+
+def get_weights(rules: Rules, n_persons: int) -> dict[str, float]:
+    """
+    Returns the weights of the terms in the score. The n_times_present term is
+    the presence spread, which is n_persons times the sum of squared
+    differences with the mean, so the weights of the other terms are
+    multiplied by n_persons to keep the balance between the terms. With
+    integer weights the score of a schedule is an exact integer, n_persons
+    times the score that is shown to the user.
+
+    Args:
+        rules (Rules): The rules containing the weights of the terms.
+        n_persons (int): The number of persons.
+
+    Returns:
+        dict[str, float]: The weight of each term in TERMS.
+    """
+    return {term: rules.params[term] * (1 if term == "n_times_present" else n_persons)
+            for term in TERMS}
+
+def get_score_from_stats(person_stats: np.ndarray, ideal_person_stats: np.ndarray,
+                         service_stats: np.ndarray, ideal_service_stats: np.ndarray,
+                         rules: Rules, linear_cost: float = None) -> float:
+    """
+    Calculates the score of a schedule from its person stats and service stats.
+
+    Args:
+        person_stats (np.ndarray): Number of persons and number of persons per
+            role present in each service.
+        ideal_person_stats (np.ndarray): The desired person stats.
+        service_stats (np.ndarray): Number of times each person is present and
+            how often their preferences are denied.
+        ideal_service_stats (np.ndarray): One-hot encoding of the preferences.
+        rules (Rules): The rules containing the weights of the terms.
+        linear_cost (float, optional): The sum of the cost matrix over the
+            schedule. Defaults to the denied morning and evening preferences
+            in the service stats.
+
+    Returns:
+        float: The score of the schedule. Lower is better.
+    """
+    weights = get_weights(rules, service_stats.shape[-1])
+
+    # Squared difference with the desired number of persons and roles
+    difference = person_stats - ideal_person_stats
+    score = weights["n_persons"] * np.sum(difference[0] ** 2)
+    score += weights["role_distribution"] * np.sum(difference[1:] ** 2)
+
+    # Compute how much each person differs from the mean number of times present
+    score += weights["n_times_present"] * get_presence_spread(service_stats[0])
+
+    # Add the preferences that are linear in the schedule to score
+    if linear_cost is None:
+        linear_cost = (np.sum(ideal_service_stats[0] * service_stats[1])
+                       + np.sum(ideal_service_stats[1] * service_stats[2]))
+    preferences = linear_cost
+
+    # Add "om de week" preference, using the best week parity of each person
+    preferences += np.sum(ideal_service_stats[2]
+                          * np.minimum(service_stats[3], service_stats[4]))
+    score += weights["preferences"] * preferences
+
+    return score
+
 def get_score(person_stats_counter: np.ndarray, ideal_person_stats: np.ndarray,
           service_stats_counter: np.ndarray, ideal_service_stats: np.ndarray,
-          rules: dict, availability: np.ndarray):
-    # Check for the difference with the ideal person stats
-    person_stats = np.matmul(person_stats_counter, availability)
-    print(f"person_stats: {person_stats}")
-    difference = person_stats - ideal_person_stats
+          rules: Rules, availability: np.ndarray, cost_matrix: np.ndarray = None):
+    if cost_matrix is None:
+        cost_matrix = get_cost_matrix(service_stats_counter, ideal_service_stats)
 
-    # Calculate the resulting score
-    score = np.inner(difference, difference)
+    # Count the number of persons and the number of persons per role present
+    person_stats = np.matmul(person_stats_counter, availability)
 
     # Count how often everyone is present and how often preferences are denied
     service_stats = np.matmul(availability, service_stats_counter).T
-    print(f"service_stats: {service_stats}")
+
+    return get_score_from_stats(person_stats, ideal_person_stats,
+                                service_stats, ideal_service_stats, rules,
+                                np.sum(cost_matrix * availability))
+
+def get_term_values_batch(person_stats_counter: np.ndarray, ideal_person_stats: np.ndarray,
+                          service_stats_counter: np.ndarray, ideal_service_stats: np.ndarray,
+                          availabilities: np.ndarray,
+                          cost_matrix: np.ndarray = None) -> np.ndarray:
+    """
+    Calculates the unweighted value of each term of the score for a stack of
+    schedules at once.
+
+    Args:
+        person_stats_counter (np.ndarray): Counts persons and roles per service.
+        ideal_person_stats (np.ndarray): The desired person stats.
+        service_stats_counter (np.ndarray): Counts presence and denied
+            preferences per person.
+        ideal_service_stats (np.ndarray): One-hot encoding of the preferences.
+        availabilities (np.ndarray): Array of shape (k, persons, services).
+        cost_matrix (np.ndarray, optional): The linear preference costs.
+            Defaults to the morning and evening preferences.
+
+    Returns:
+        np.ndarray: Array of shape (k, terms), with the terms in the order of
+            TERMS.
+    """
+    if cost_matrix is None:
+        cost_matrix = get_cost_matrix(service_stats_counter, ideal_service_stats)
+
+    term_values = np.zeros((len(availabilities), len(TERMS)))
+
+    # Person stats of shape (k, counters, services)
+    person_stats = np.einsum("cp,kps->kcs", person_stats_counter, availabilities)
+    difference = person_stats - ideal_person_stats
+    squared = np.einsum("kcs,kcs->kc", difference, difference)
+    term_values[:, 0] = squared[:, 0]
+    term_values[:, 1] = squared[:, 1:].sum(axis=1)
+
+    # Service stats of shape (k, counters, persons)
+    service_stats = np.einsum("kps,sc->kcp", availabilities, service_stats_counter)
 
     # Compute how much each person differs from the mean number of times present
-    avg_presence = np.mean(service_stats[0])
-    difference = service_stats[0] - avg_presence
-    score += np.inner(difference, difference)
+    term_values[:, 2] = get_presence_spread(service_stats[:, 0])
+
+    # Add the preferences that are linear in the schedule
+    term_values[:, 3] = np.einsum("ps,kps->k", cost_matrix, availabilities)
+
+    # Add "om de week" preference, using the best week parity of each person
+    term_values[:, 3] += np.einsum("p,kp->k", ideal_service_stats[2],
+                                   np.minimum(service_stats[:, 3], service_stats[:, 4]))
+
+    return term_values
+
+def get_score_batch(person_stats_counter: np.ndarray, ideal_person_stats: np.ndarray,
+                    service_stats_counter: np.ndarray, ideal_service_stats: np.ndarray,
+                    rules: Rules, availabilities: np.ndarray,
+                    cost_matrix: np.ndarray = None) -> np.ndarray:
+    """
+    Calculates the score of a stack of schedules at once. The result is the
+    same as calling get_score on each schedule separately.
+
+    Args:
+        person_stats_counter (np.ndarray): Counts persons and roles per service.
+        ideal_person_stats (np.ndarray): The desired person stats.
+        service_stats_counter (np.ndarray): Counts presence and denied
+            preferences per person.
+        ideal_service_stats (np.ndarray): One-hot encoding of the preferences.
+        rules (Rules): The rules containing the weights of the terms.
+        availabilities (np.ndarray): Array of shape (k, persons, services).
+        cost_matrix (np.ndarray, optional): The linear preference costs.
+            Defaults to the morning and evening preferences.
+
+    Returns:
+        np.ndarray: The k scores.
+    """
+    term_values = get_term_values_batch(person_stats_counter, ideal_person_stats,
+                                        service_stats_counter, ideal_service_stats,
+                                        availabilities, cost_matrix)
+    return term_values @ get_weight_vector(rules, availabilities.shape[1])
+
+def get_weight_vector(rules: Rules, n_persons: int) -> np.ndarray:
+    """
+    Returns the weights of the terms in the score in the order of TERMS, see
+    get_weights.
+    """
+    weights = get_weights(rules, n_persons)
+    return np.array([weights[term] for term in TERMS], dtype=float)
+
+def sweep_weights(term_values: np.ndarray, weight_matrix: np.ndarray,
+                  n_persons: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Scores every schedule for every weight setting and finds the best
+    schedule per weight setting.
+
+    Args:
+        term_values (np.ndarray): Unweighted term values of shape
+            (schedules, terms), as returned by get_term_values_batch.
+        weight_matrix (np.ndarray): Weight settings of shape (weights, terms),
+            like Rules.params, with the terms in the order of TERMS.
+        n_persons (int): The number of persons, by which the weights are
+            scaled as in get_weights.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The index of the best schedule for each
+            weight setting, and the scores of shape (weights, schedules).
+    """
+    scale = np.array([1 if term == "n_times_present" else n_persons for term in TERMS])
+    scores = (np.asarray(weight_matrix, dtype=float) * scale) @ term_values.T
+    return np.argmin(scores, axis=1), scores
 
-    # Add morning preference to score
-    score += np.sum(ideal_service_stats[0] * service_stats[1])
 
-    # Add evening preference to score
-    score += np.sum(ideal_service_stats[1] * service_stats[2])
+################################################
+# ------------- Score breakdown -------------- #
+################################################
 
+class ScoreBreakdown(BaseModel):
+    """
+    This class represents the decomposition of a score into its terms and
+    into the contributions of each person and each service.
+
+    The n_persons and role_distribution terms are attributed to services, the
+    n_times_present term is attributed to persons and the preferences term is
+    attributed to both. Each array sums to the weighted value of its term.
+    The weights are those of get_weights, so the total is the score of
+    get_score.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    terms: dict[str, float]
+    weights: dict[str, float]
+    weighted_terms: dict[str, float]
+    by_person: dict[str, np.ndarray]
+    by_service: dict[str, np.ndarray]
+    total: float
+
+def get_score_breakdown(person_stats_counter: np.ndarray, ideal_person_stats: np.ndarray,
+                        service_stats_counter: np.ndarray, ideal_service_stats: np.ndarray,
+                        rules: Rules, availability: np.ndarray,
+                        cost_matrix: np.ndarray = None) -> ScoreBreakdown:
+    """
+    Calculates the score of a schedule together with its decomposition per
+    term, per person and per service.
+
+    Args:
+        person_stats_counter (np.ndarray): Counts persons and roles per service.
+        ideal_person_stats (np.ndarray): The desired person stats.
+        service_stats_counter (np.ndarray): Counts presence and denied
+            preferences per person.
+        ideal_service_stats (np.ndarray): One-hot encoding of the preferences.
+        rules (Rules): The rules containing the weights of the terms.
+        availability (np.ndarray): The schedule.
+        cost_matrix (np.ndarray, optional): The linear preference costs.
+            Defaults to the morning and evening preferences.
+
+    Returns:
+        ScoreBreakdown: The decomposition of the score.
+    """
+    if cost_matrix is None:
+        cost_matrix = get_cost_matrix(service_stats_counter, ideal_service_stats)
+
+    weights = get_weights(rules, len(availability))
+
+    # Squared difference with the desired number of persons and roles per service
+    person_stats = np.matmul(person_stats_counter, availability)
+    difference = person_stats - ideal_person_stats
+    n_persons = difference[0] ** 2
+    role_distribution = np.sum(difference[1:] ** 2, axis=0)
+
+    # Squared difference with the mean number of times present per person,
+    # times the number of persons
+    presence = np.matmul(availability, service_stats_counter[:, 0])
+    n_times_present = len(presence) * (presence - np.mean(presence)) ** 2
+
+    # Denied "om de week" preferences per cell, for the best week parity of
+    # each person, on top of the linear preference costs
+    week_stats = np.matmul(availability, service_stats_counter[:, 3:5])
+    week_counter = np.where((week_stats[:, 0] <= week_stats[:, 1])[:, None],
+                            service_stats_counter[:, 3], service_stats_counter[:, 4])
+    preference_costs = cost_matrix + ideal_service_stats[2][:, None] * week_counter
+    preferences = preference_costs * availability
+
+    by_service = {
+        "n_persons": weights["n_persons"] * n_persons,
+        "role_distribution": weights["role_distribution"] * role_distribution,
+        "preferences": weights["preferences"] * preferences.sum(axis=0),
+    }
+    by_person = {
+        "n_times_present": weights["n_times_present"] * n_times_present,
+        "preferences": weights["preferences"] * preferences.sum(axis=1),
+    }
+
+    terms = {
+        "n_persons": float(np.sum(n_persons)),
+        "role_distribution": float(np.sum(role_distribution)),
+        "n_times_present": float(get_presence_spread(presence)),
+        "preferences": float(np.sum(preferences)),
+    }
+    weighted_terms = {term: weights[term] * value for term, value in terms.items()}
+
+    return ScoreBreakdown(terms=terms, weights=weights, weighted_terms=weighted_terms,
+                          by_person=by_person, by_service=by_service,
+                          total=sum(weighted_terms.values()))
 
-    return score
+
+################################################
+# ------------ Incremental scoring ----------- #
+################################################
+
+class IncrementalScorer:
+    """
+    Keeps the person stats and service stats of a schedule up to date, so that
+    the score change of flipping a single cell can be computed in
+    O(roles + terms) instead of recomputing the full matrix products.
+
+    Flips are applied with `flip` and are kept until `commit` is called, or
+    undone in reverse order by `rollback`. The stats are kept as Python
+    integers, as numpy scalar arithmetic dominates at these matrix sizes.
+    """
+    def __init__(self, person_stats_counter: np.ndarray,
+                 ideal_person_stats: np.ndarray,
+                 service_stats_counter: np.ndarray,
+                 ideal_service_stats: np.ndarray,
+                 rules: Rules, availability: np.ndarray,
+                 cost_matrix: np.ndarray = None):
+
+        if cost_matrix is None:
+            cost_matrix = get_cost_matrix(service_stats_counter, ideal_service_stats)
+
+        self.person_stats_counter = person_stats_counter
+        self.ideal_person_stats = ideal_person_stats
+        self.service_stats_counter = service_stats_counter
+        self.ideal_service_stats = ideal_service_stats
+        self.cost_matrix = cost_matrix
+        self.rules = rules
+
+        # Work on a copy, so the caller's matrix isn't changed by flips
+        availability = np.array(availability, dtype=int)
+        person_stats = person_stats_counter @ availability
+        service_stats = availability @ service_stats_counter
+        self.score = get_score_from_stats(person_stats, ideal_person_stats,
+                                          service_stats.T, ideal_service_stats, rules,
+                                          np.sum(cost_matrix * availability)).item()
+
+        self._cells = availability.tolist()
+        self._person_stats = person_stats.tolist()
+        self._service_stats = service_stats.tolist()
+        self._ideal_person_stats = ideal_person_stats.tolist()
+        self._costs = cost_matrix.tolist()
+        self._week_persons = ideal_service_stats[2].tolist()
+        self._n_persons = availability.shape[0]
+        self._total_presence = int(service_stats[:, 0].sum())
+
+        self._weights = get_weights(rules, self._n_persons)
+
+        # The counter rows that are nonzero for each person, i.e. the person
+        # count and the role of that person, with their value and weight
+        self._person_rows = []
+        for i in range(person_stats_counter.shape[1]):
+            rows = []
+            for k in np.flatnonzero(person_stats_counter[:, i]):
+                term = "n_persons" if k == 0 else "role_distribution"
+                rows.append((int(k), int(person_stats_counter[k, i]),
+                             self._weights[term]))
+            self._person_rows.append(rows)
+
+        # The counter columns that are nonzero for each service
+        self._service_cols = []
+        for row in service_stats_counter.tolist():
+            self._service_cols.append([(t, c) for t, c in enumerate(row) if c != 0])
+        self._present_counts = service_stats_counter[:, 0].tolist()
+        self._week_counts = service_stats_counter[:, 3:5].tolist()
+
+        # Flips since the last commit
+        self._journal = []
+
+    @property
+    def availability(self) -> np.ndarray:
+        """
+        A copy of the current schedule.
+        """
+        return np.array(self._cells, dtype=int)
+
+    @property
+    def person_stats(self) -> np.ndarray:
+        """
+        A copy of the current person stats.
+        """
+        return np.array(self._person_stats)
+
+    @property
+    def service_stats(self) -> np.ndarray:
+        """
+        A copy of the current service stats, with a row per person.
+        """
+        return np.array(self._service_stats)
+
+    @property
+    def total_presence(self) -> int:
+        """
+        The number of times present, summed over all persons.
+        """
+        return self._total_presence
+
+    def get(self, person: int, service: int) -> int:
+        """
+        Returns the current value of the given cell.
+        """
+        return self._cells[person][service]
+
+    def flip_delta(self, person: int, service: int) -> float:
+        """
+        Returns the change in score when flipping the given cell, without
+        changing the schedule.
+
+        Args:
+            person (int): Row index of the cell.
+            service (int): Column index of the cell.
+
+        Returns:
+            float: The new score minus the current score.
+        """
+        weights = self._weights
+        d = 1 - 2 * self._cells[person][service]
+
+        # Squared difference with the desired number of persons and roles
+        delta = 0
+        for k, c, weight in self._person_rows[person]:
+            diff = self._person_stats[k][service] - self._ideal_person_stats[k][service]
+            delta += weight * (2 * d * c * diff + c * c)
+
+        # Spread of the number of times present: n * sum(x^2) - sum(x)^2
+        stats = self._service_stats[person]
+        c = self._present_counts[service]
+        if c:
+            spread = (self._n_persons * (2 * d * c * stats[0] + c * c)
+                      - (2 * d * c * self._total_presence + c * c))
+            delta += weights["n_times_present"] * spread
+
+        # Preferences that are linear in the schedule
+        preferences = d * self._costs[person][service]
+
+        # "Om de week" preference counts the denials of the best week parity
+        if self._week_persons[person]:
+            even, odd = stats[3], stats[4]
+            c_even, c_odd = self._week_counts[service]
+            preferences += (min(even + d * c_even, odd + d * c_odd) - min(even, odd))
+
+        return delta + weights["preferences"] * preferences
+
+    def flip(self, person: int, service: int) -> float:
+        """
+        Flips the given cell and updates the stats and the score.
+
+        Args:
+            person (int): Row index of the cell.
+            service (int): Column index of the cell.
+
+        Returns:
+            float: The change in score.
+        """
+        delta = self.flip_delta(person, service)
+        self._apply(person, service)
+        self.score += delta
+
+        self._journal.append((person, service, delta))
+        return delta
+
+    def commit(self):
+        """
+        Accepts all flips since the last commit.
+        """
+        self._journal.clear()
+
+    def rollback(self):
+        """
+        Undoes all flips since the last commit.
+        """
+        while self._journal:
+            person, service, delta = self._journal.pop()
+            self._apply(person, service)
+            self.score -= delta
+
+    def _apply(self, person: int, service: int):
+        # Flip the cell and update the stats it contributes to
+        row = self._cells[person]
+        d = 1 - 2 * row[service]
+        row[service] += d
+
+        for k, c, _ in self._person_rows[person]:
+            self._person_stats[k][service] += d * c
+
+        stats = self._service_stats[person]
+        for t, c in self._service_cols[service]:
+            stats[t] += d * c
+        self._total_presence += d * self._present_counts[service]
 
 
-num_services = len(services_to_list(services_dict))
-availability_ = np.ones((len(kerkenraad), num_services))
+################################################
+# ------------- Buffered scoring ------------- #
+################################################
 
-person_stats_counter_ = get_person_stats_counter(Rules(), kerkenraad)
-#print(f"person_stats_counter: {person_stats_counter}")
-service_stats_counter_ = get_service_stats_counter(services_dict)
-#print(f"service_stats_counter: {service_stats_counter}")
-ideal_person_stats_ = get_ideal_person_stats(Rules(), num_services)
-#print(f"ideal_person_stats: {ideal_person_stats}")
-ideal_service_stats_ = get_ideal_service_stats(kerkenraad)
-print(f"ideal_service_stats: {ideal_service_stats_}")
+class BufferedScorer:
+    """
+    Scores schedules of a fixed shape without allocating arrays per call. All
+    intermediate results, including the reductions, are written into buffers
+    that are allocated once, when the scorer is created, together with the
+    views of them that score_into uses.
+    """
+    def __init__(self, person_stats_counter: np.ndarray,
+                 ideal_person_stats: np.ndarray,
+                 service_stats_counter: np.ndarray,
+                 ideal_service_stats: np.ndarray,
+                 rules: Rules, cost_matrix: np.ndarray = None):
+
+        if cost_matrix is None:
+            cost_matrix = get_cost_matrix(service_stats_counter, ideal_service_stats)
+
+        self.person_stats_counter = np.ascontiguousarray(person_stats_counter, dtype=int)
+        self.ideal_person_stats = np.ascontiguousarray(ideal_person_stats, dtype=int)
+        self.service_stats_counter = np.ascontiguousarray(service_stats_counter, dtype=int)
+        self.week_persons = np.ascontiguousarray(ideal_service_stats[2], dtype=int)
+        self.cost_matrix = np.ascontiguousarray(cost_matrix, dtype=int)
+
+        n_counters, n_services = self.ideal_person_stats.shape
+        n_service_counters = self.service_stats_counter.shape[1]
+        n_persons = self.person_stats_counter.shape[1]
+        self.weights = get_weight_vector(rules, n_persons)
+        self.n_persons = np.array(n_persons)
+
+        # Buffers for the intermediate results, with a row per person in the
+        # service stats
+        self.person_stats = np.empty((n_counters, n_services), dtype=int)
+        self.service_stats = np.empty((n_persons, n_service_counters), dtype=int)
+        self.preference_stats = np.empty((n_persons, n_services), dtype=int)
+        self.week_stats = np.empty(n_persons, dtype=int)
+
+        # Buffers for the reductions: the term values in the order of TERMS,
+        # the total presence, the "om de week" denials and the score
+        self.terms = np.empty(len(TERMS), dtype=int)
+        self.float_terms = np.empty(len(TERMS))
+        self.total_presence = np.empty((), dtype=int)
+        self.week_denials = np.empty((), dtype=int)
+        self.score = np.empty(())
+
+        # Views, so score_into doesn't create them on every call
+        self._persons_row = self.person_stats[0]
+        self._flat_person_stats = self.person_stats.reshape(-1)
+        self._presence = self.service_stats[:, 0]
+        self._even_weeks = self.service_stats[:, 3]
+        self._odd_weeks = self.service_stats[:, 4]
+        self._term_values = [self.terms[i, ...] for i in range(len(TERMS))]
+
+    def score_into(self, availability: np.ndarray) -> float:
+        """
+        Calculates the score of the given schedule, writing all intermediate
+        results into the buffers of this scorer.
+
+        Args:
+            availability (np.ndarray): Integer matrix of zeros and ones with a
+                row per person and a column per service.
+
+        Returns:
+            float: The score of the schedule. Lower is better.
+        """
+        n_persons, role_distribution, n_times_present, preferences = self._term_values
+        person_stats = self.person_stats
+        presence = self._presence
+
+        # Squared difference with the desired number of persons and roles
+        np.matmul(self.person_stats_counter, availability, out=person_stats)
+        np.subtract(person_stats, self.ideal_person_stats, out=person_stats)
+        np.matmul(self._persons_row, self._persons_row, out=n_persons)
+        np.matmul(self._flat_person_stats, self._flat_person_stats, out=role_distribution)
+        np.subtract(role_distribution, n_persons, out=role_distribution)
+
+        # Spread of the number of times present: n * sum(x^2) - sum(x)^2
+        np.matmul(availability, self.service_stats_counter, out=self.service_stats)
+        np.matmul(presence, presence, out=n_times_present)
+        np.multiply(n_times_present, self.n_persons, out=n_times_present)
+        np.add.reduce(presence, out=self.total_presence)
+        np.multiply(self.total_presence, self.total_presence, out=self.total_presence)
+        np.subtract(n_times_present, self.total_presence, out=n_times_present)
+
+        # Linear and "om de week" preferences
+        np.multiply(self.cost_matrix, availability, out=self.preference_stats)
+        np.add.reduce(self.preference_stats, axis=None, out=preferences)
+        np.minimum(self._even_weeks, self._odd_weeks, out=self.week_stats)
+        np.matmul(self.week_persons, self.week_stats, out=self.week_denials)
+        np.add(preferences, self.week_denials, out=preferences)
+
+        np.copyto(self.float_terms, self.terms)
+        np.matmul(self.float_terms, self.weights, out=self.score)
+        return self.score.item()
 
 
+################################################
+# -------------- Scoring context ------------- #
+################################################
 
-schedule_score = get_score(person_stats_counter_, ideal_person_stats_,
-                  service_stats_counter_, ideal_service_stats_,
-                  Rules(), availability_)
+class ScoringContext:
+    """
+    Holds everything needed to score schedules for a given set of persons,
+    services and rules, so the counter matrices and the cost matrix are only
+    built once. If an availability is given, its "~" marks are part of the
+    cost matrix.
+    """
+    def __init__(self, persons: dict, services: dict, rules: Rules,
+                 availability: np.ndarray = None):
+        self.rules = rules
+        self.n_persons = len(persons)
+        self.n_services = len(services_to_list(services))
+
+        self.person_stats_counter = get_person_stats_counter(rules, persons)
+        self.service_stats_counter = get_service_stats_counter(services)
+        self.ideal_person_stats = get_ideal_person_stats(rules, self.n_services)
+        self.ideal_service_stats = get_ideal_service_stats(persons)
+        self.cost_matrix = get_cost_matrix(self.service_stats_counter,
+                                           self.ideal_service_stats, rules, availability)
+
+        # The counter matrices packed as bitset masks, see
+        # packed_schedule.get_packed_masks, which builds them on first use
+        self.packed_masks = None
+
+    def score(self, availability: np.ndarray) -> float:
+        """
+        Returns the score of the given schedule.
+        """
+        return get_score(self.person_stats_counter, self.ideal_person_stats,
+                         self.service_stats_counter, self.ideal_service_stats,
+                         self.rules, availability, self.cost_matrix)
+
+    def score_breakdown(self, availability: np.ndarray) -> ScoreBreakdown:
+        """
+        Returns the decomposition of the score of the given schedule.
+        """
+        return get_score_breakdown(self.person_stats_counter, self.ideal_person_stats,
+                                   self.service_stats_counter, self.ideal_service_stats,
+                                   self.rules, availability, self.cost_matrix)
+
+    def score_batch(self, availabilities: np.ndarray) -> np.ndarray:
+        """
+        Returns the scores of a stack of schedules.
+        """
+        return get_score_batch(self.person_stats_counter, self.ideal_person_stats,
+                               self.service_stats_counter, self.ideal_service_stats,
+                               self.rules, availabilities, self.cost_matrix)
+
+    def term_values_batch(self, availabilities: np.ndarray) -> np.ndarray:
+        """
+        Returns the unweighted term values of a stack of schedules.
+        """
+        return get_term_values_batch(self.person_stats_counter, self.ideal_person_stats,
+                                     self.service_stats_counter, self.ideal_service_stats,
+                                     availabilities, self.cost_matrix)
+
+    def sweep_weights(self, availabilities: np.ndarray, weight_matrix: np.ndarray
+                      ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the index of the best schedule for each weight setting, and
+        the scores of every schedule for every weight setting.
+        """
+        return sweep_weights(self.term_values_batch(availabilities), weight_matrix,
+                             self.n_persons)
+
+    def buffered_scorer(self) -> BufferedScorer:
+        """
+        Returns a scorer that scores schedules without allocating per call.
+        """
+        return BufferedScorer(self.person_stats_counter, self.ideal_person_stats,
+                              self.service_stats_counter, self.ideal_service_stats,
+                              self.rules, self.cost_matrix)
+
+    def incremental_scorer(self, availability: np.ndarray) -> IncrementalScorer:
+        """
+        Returns an incremental scorer starting from the given schedule.
+        """
+        return IncrementalScorer(self.person_stats_counter, self.ideal_person_stats,
+                                 self.service_stats_counter, self.ideal_service_stats,
+                                 self.rules, availability, self.cost_matrix)
+
+# Maximum number of scoring contexts kept in the cache
+CONTEXT_CACHE_SIZE = 16
+
+_context_cache: OrderedDict[str, ScoringContext] = OrderedDict()
+
+def get_context_key(persons: dict, services: dict, rules: Rules,
+                    availability: np.ndarray = None) -> str:
+    """
+    Returns a hash of the contents of the persons, services and rules, and of
+    the "~" marks in the availability.
+
+    Args:
+        persons (dict): Dictionary of person info.
+        services (dict): Contains the services for each date.
+        rules (Rules): The rules by which the schedule must abide.
+        availability (np.ndarray, optional): The availability.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    marks = None
+    if availability is not None:
+        marks = np.flatnonzero(np.asarray(availability) == 2).tolist()
+
+    content = json.dumps({
+        "persons": persons,
+        "services": [[str(date), day] for date, day in services.items()],
+        "rules": rules.model_dump(),
+        "marks": marks,
+    }, sort_keys=True, default=str)
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def get_scoring_context(persons: dict, services: dict, rules: Rules,
+                        availability: np.ndarray = None) -> ScoringContext:
+    """
+    Returns the scoring context for the given persons, services and rules.
+    Contexts are cached by content, the least recently used context is
+    evicted when the cache is full.
+
+    Args:
+        persons (dict): Dictionary of person info.
+        services (dict): Contains the services for each date.
+        rules (Rules): The rules by which the schedule must abide.
+        availability (np.ndarray, optional): The availability, of which the
+            "~" marks are added to the cost matrix.
+
+    Returns:
+        ScoringContext: The (possibly cached) scoring context.
+    """
+    key = get_context_key(persons, services, rules, availability)
+
+    if key in _context_cache:
+        _context_cache.move_to_end(key)
+        return _context_cache[key]
+
+    context = ScoringContext(persons, services, rules, availability)
+    _context_cache[key] = context
+    if len(_context_cache) > CONTEXT_CACHE_SIZE:
+        _context_cache.popitem(last=False)
+
+    return context
+
+
+def benchmark_score_into(context: ScoringContext, n_calls: int = 10000) -> dict:
+    """
+    Measures the speed of BufferedScorer.score_into on a random schedule, and
+    the numpy array buffers that are left allocated per call, as traced by
+    tracemalloc in the domain of numpy. The peak is the memory numpy's
+    dispatch takes while a call runs. It is about the same for a single
+    ufunc call on 0-d arrays, and doesn't grow with the schedule.
+
+    Args:
+        context (ScoringContext): The scoring context.
+        n_calls (int, optional): The number of calls. Defaults to 10000.
+
+    Returns:
+        dict: The calls per second, the number and bytes of the array
+            buffers left allocated per call, and the peak number of bytes
+            in use during the calls.
+    """
+    rng = np.random.default_rng(0)
+    availability = rng.integers(0, 2, (context.n_persons, context.n_services))
+    scorer = context.buffered_scorer()
+    scorer.score_into(availability)
+
+    # Measure the speed
+    t_start = time.perf_counter()
+    for _ in range(n_calls):
+        scorer.score_into(availability)
+    calls_per_second = n_calls / (time.perf_counter() - t_start)
+
+    # Count the array buffers that are in use before and after the calls
+    arrays_filter = [tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot().filter_traces(arrays_filter)
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for _ in range(n_calls):
+        scorer.score_into(availability)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    after = tracemalloc.take_snapshot().filter_traces(arrays_filter)
+    tracemalloc.stop()
+
+    differences = after.compare_to(before, "filename")
+    n_blocks = sum(difference.count_diff for difference in differences)
+    n_bytes = sum(difference.size_diff for difference in differences)
+
+    return {"calls_per_second": calls_per_second,
+            "array_blocks_per_call": n_blocks / n_calls,
+            "array_bytes_per_call": n_bytes / n_calls,
+            "peak_bytes": peak}
+
+
+if __name__ == "__main__":
+    scoring_context = get_scoring_context(kerkenraad, services_dict, Rules())
+    availability_ = np.ones((scoring_context.n_persons, scoring_context.n_services))
+    print(scoring_context.score(availability_))
+    print(benchmark_score_into(scoring_context))